@@ -0,0 +1,43 @@
+"""Helpers the benchmarks share: run metadata, result files and the baseline check."""
+import argparse
+from collections.abc import Callable
+import json
+from pathlib import Path
+import socket
+import subprocess
+import sys
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def git_commit() -> str | None:
+    try:
+        result = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, cwd=ROOT)
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def add_result_arguments(parser: argparse.ArgumentParser, tolerance: float) -> None:
+    parser.add_argument('--output', type=Path, help='also write the result to this file')
+    parser.add_argument('--baseline', type=Path, help='earlier result to compare with')
+    parser.add_argument('--tolerance', type=float, default=tolerance, help='allowed slowdown against the baseline')
+
+
+def report(result: dict, args: argparse.Namespace, compare: Callable[[dict, dict, float], list[str]]) -> int:
+    """Print the result, write it to --output and return 1 if it regressed against --baseline."""
+    print(json.dumps(result))
+    if args.output is not None:
+        args.output.write_text(json.dumps(result, indent=2))
+    if args.baseline is not None:
+        regressions = compare(json.loads(args.baseline.read_text()), result, args.tolerance)
+        for regression in regressions:
+            print(f'Regression: {regression}', file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
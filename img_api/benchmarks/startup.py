@@ -0,0 +1,118 @@
+"""Boot time of a worker: importing `main` and starting the app until it serves `/`.
+
+Every sample is taken in a fresh interpreter, after one uncounted run that
+compiles the bytecode. `import_s` is the time to import `main`, which every
+test session and every new worker pays; `boot_s` starts uvicorn, with the
+app's startup hooks running against the configured database, and lasts until
+`/` answers. The service's own modules that took longest to import are listed
+from `python -X importtime`. With --baseline the run is compared with an
+earlier result and exits with status 1 if it got slower.
+
+    poetry run python -m benchmarks.startup --runs 10 --output startup.json
+    poetry run python -m benchmarks.startup --runs 10 --baseline startup.json
+"""
+import argparse
+from datetime import datetime, timezone
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from urllib.error import URLError
+from urllib.request import urlopen
+
+from benchmarks.common import ROOT, add_result_arguments, free_port, git_commit, report
+
+APP_PACKAGES = {
+    path.stem for path in ROOT.iterdir()
+    if path.name == 'main.py' or (path / '__init__.py').exists()
+} - {'benchmarks', 'migrations', 'tests'}
+IMPORT_MAIN = 'import time; start = time.perf_counter(); import main; print(time.perf_counter() - start)'
+
+
+def summary(samples: list[float]) -> dict:
+    return {'median': statistics.median(samples), 'min': min(samples), 'max': max(samples)}
+
+
+def measure_import(python: str) -> float:
+    result = subprocess.run([python, '-c', IMPORT_MAIN], capture_output=True, text=True, cwd=ROOT, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def slowest_modules(python: str, count: int) -> dict[str, float]:
+    """Cumulative import time in ms of the service's own modules, slowest first."""
+    result = subprocess.run([python, '-X', 'importtime', '-c', 'import main'], capture_output=True, text=True, cwd=ROOT)
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line.removeprefix('import time:').split('|'))
+        if cumulative.isdigit() and name.split('.')[0] in APP_PACKAGES:
+            modules[name] = int(cumulative) / 1000
+    return dict(sorted(modules.items(), key=lambda item: item[1], reverse=True)[:count])
+
+
+def measure_boot(python: str, timeout: float) -> float:
+    port = free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [python, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning'],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f'The app exited with status {process.returncode} during startup')
+            try:
+                with urlopen(f'http://127.0.0.1:{port}/', timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except (URLError, ConnectionError):
+                pass
+            if time.perf_counter() - start > timeout:
+                raise RuntimeError(f'The app did not answer within {timeout:.0f}s')
+            time.sleep(0.01)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def compare(baseline: dict, result: dict, tolerance: float) -> list[str]:
+    """Return a line for every median that grew by more than the tolerance allows."""
+    regressions = []
+    for key in ('import_s', 'boot_s'):
+        now, before = result.get(key), baseline.get(key)
+        if now is None or before is None:
+            continue
+        if now['median'] > before['median'] * (1 + tolerance):
+            regressions.append(f'{key}: median {now["median"]:.3f}s, was {before["median"]:.3f}s')
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--python', default=sys.executable, help='interpreter with the service dependencies')
+    parser.add_argument('--no-boot', action='store_true', help='only measure the import, without a database')
+    parser.add_argument('--boot-timeout', type=float, default=60.0)
+    parser.add_argument('--modules', type=int, default=10, help='number of slowest modules to list')
+    add_result_arguments(parser, tolerance=0.25)
+    args = parser.parse_args()
+
+    measure_import(args.python)
+    result = {
+        'benchmark': 'startup',
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'runs': args.runs,
+        'import_s': summary([measure_import(args.python) for _ in range(args.runs)]),
+        'boot_s': None if args.no_boot else summary([measure_boot(args.python, args.boot_timeout) for _ in range(args.runs)]),
+        'slowest_modules_ms': slowest_modules(args.python, args.modules),
+    }
+    return report(result, args, compare)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,272 @@
+"""Throughput and latency of a mixed create/list/get/delete workload.
+
+Runs img_api in-process against the test database. Behind it minio_api is
+started from ../minio_api with `benchmarks.serve`, which keeps the objects in
+an in-memory S3 fake, so neither MinIO nor the docker network is needed. Pass
+--minio-api-url to use a `benchmarks.serve` that is already running instead.
+
+Every concurrency level runs the same seeded sequence of operations and the
+result is printed as one JSON document. With --baseline the run is compared
+with an earlier result and exits with status 1 if it got slower.
+
+    poetry run python -m benchmarks.workload --concurrency 1 8 32 --requests 500 --output bench.json
+    poetry run python -m benchmarks.workload --concurrency 1 8 32 --requests 500 --baseline bench.json
+"""
+import argparse
+import asyncio
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+import logging
+from pathlib import Path
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+import aiohttp
+from httpx import AsyncClient, ASGITransport, Response
+from sqlalchemy import text
+from sqlmodel import SQLModel
+
+from benchmarks.common import add_result_arguments, free_port, git_commit, report
+from utils.config import settings
+
+OPERATIONS = ('create', 'list', 'get', 'image', 'delete')
+DEFAULT_MIX = 'create=20,list=20,get=40,image=10,delete=10'
+IMAGE = Path(__file__).resolve().parents[1] / 'tests' / 'img' / 'shark.jpg'
+MINIO_API_DIR = Path(__file__).resolve().parents[2] / 'minio_api'
+
+
+def percentiles(samples: list[float]) -> dict:
+    if len(samples) < 2:
+        return {'p50': None, 'p95': None, 'p99': None}
+    q = statistics.quantiles(samples, n=100)
+    return {'p50': q[49], 'p95': q[94], 'p99': q[98]}
+
+
+def parse_mix(value: str) -> dict[str, int]:
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        if name not in OPERATIONS or not weight.isdigit():
+            raise argparse.ArgumentTypeError(f'expected operation=weight with operations {OPERATIONS}, got {item!r}')
+        mix[name] = int(weight)
+    return mix
+
+
+class Workload:
+    """Sends operations to img_api and keeps their latencies; ids of live memes are tracked for get and delete."""
+
+    def __init__(self, client: AsyncClient, image: bytes) -> None:
+        self.client = client
+        self.image = image
+        self.live: list[int] = []
+        self.created = 0
+        # Names differ between runs, so a reused minio_api never finds an upload unchanged
+        self.run_id = uuid.uuid4().hex[:8]
+        self.latency_ms: dict[str, list[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+
+    def reset_stats(self) -> None:
+        self.latency_ms.clear()
+        self.errors.clear()
+
+    async def create(self) -> Response:
+        self.created += 1
+        response = await self.client.post(
+            'api/memes/',
+            files={'file': (f'bench-{self.run_id}-{self.created}.jpg', self.image, 'image/jpeg')},
+            data={'description': f'benchmark meme {self.created}'},
+        )
+        if response.is_success:
+            self.live.append(response.json()['id'])
+        return response
+
+    async def list_page(self) -> Response:
+        return await self.client.get('api/memes/', params={'limit': 50})
+
+    async def get(self, meme_id: int) -> Response:
+        return await self.client.get(f'api/memes/{meme_id}')
+
+    async def download(self, meme_id: int) -> Response:
+        return await self.client.get(f'api/memes/{meme_id}/image')
+
+    async def delete(self, meme_id: int) -> Response:
+        return await self.client.delete(f'api/memes/{meme_id}')
+
+    async def run(self, operation: str, rng: random.Random) -> None:
+        # Operations on a meme fall back to a create while there is nothing to act on
+        if operation in ('get', 'image', 'delete') and not self.live:
+            operation = 'create'
+        start = time.perf_counter()
+        if operation == 'create':
+            response = await self.create()
+        elif operation == 'list':
+            response = await self.list_page()
+        elif operation == 'get':
+            response = await self.get(rng.choice(self.live))
+        elif operation == 'image':
+            response = await self.download(rng.choice(self.live))
+        else:
+            response = await self.delete(self.live.pop(rng.randrange(len(self.live))))
+        self.latency_ms[operation].append((time.perf_counter() - start) * 1000)
+        if not response.is_success:
+            self.errors[operation] += 1
+
+
+async def run_level(workload: Workload, mix: dict[str, int], concurrency: int, requests: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    operations = iter(rng.choices(list(mix), weights=list(mix.values()), k=requests))
+
+    async def worker():
+        for operation in operations:
+            await workload.run(operation, rng)
+
+    workload.reset_stats()
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        'concurrency': concurrency,
+        'requests': requests,
+        'elapsed_s': elapsed,
+        'requests_per_second': requests / elapsed,
+        'errors': sum(workload.errors.values()),
+        'latency_ms': percentiles([ms for samples in workload.latency_ms.values() for ms in samples]),
+        'operations': {
+            operation: {
+                'count': len(samples),
+                'errors': workload.errors[operation],
+                'latency_ms': percentiles(samples),
+            }
+            for operation, samples in sorted(workload.latency_ms.items())
+        },
+    }
+
+
+def compare(baseline: dict, result: dict, tolerance: float) -> list[str]:
+    """Return a line for every concurrency level whose throughput or p95 got worse than the tolerance allows."""
+    previous = {level['concurrency']: level for level in baseline['levels']}
+    regressions = []
+    for level in result['levels']:
+        before = previous.get(level['concurrency'])
+        if before is None:
+            continue
+        if level['requests_per_second'] < before['requests_per_second'] * (1 - tolerance):
+            regressions.append(
+                f'concurrency {level["concurrency"]}: {level["requests_per_second"]:.1f} req/s, '
+                f'was {before["requests_per_second"]:.1f}'
+            )
+        p95, p95_before = level['latency_ms']['p95'], before['latency_ms']['p95']
+        if p95 is not None and p95_before is not None and p95 > p95_before * (1 + tolerance):
+            regressions.append(f'concurrency {level["concurrency"]}: p95 {p95:.1f} ms, was {p95_before:.1f}')
+    return regressions
+
+
+def start_minio_api(python: str, directory: Path, s3_latency: float) -> tuple[subprocess.Popen, str]:
+    port = free_port()
+    process = subprocess.Popen(
+        [python, '-m', 'benchmarks.serve', '--port', str(port), '--s3-latency', str(s3_latency)],
+        cwd=directory,
+        stdout=subprocess.DEVNULL,
+    )
+    return process, f'http://127.0.0.1:{port}{settings.API_PREFIX}/'
+
+
+async def wait_until_ready(url: str, process: subprocess.Popen | None, timeout: float = 60.0) -> None:
+    root = url.removesuffix(f'{settings.API_PREFIX}/') + '/'
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while True:
+            if process is not None and process.poll() is not None:
+                raise RuntimeError(f'minio_api exited with status {process.returncode}')
+            try:
+                async with session.get(root) as resp:
+                    if resp.ok:
+                        return
+            except aiohttp.ClientError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f'minio_api at {url} did not start in {timeout:.0f}s')
+            await asyncio.sleep(0.2)
+
+
+async def run(args: argparse.Namespace, minio_api_url: str) -> dict:
+    # Settings are read by the modules below when they are imported
+    settings.GW_ROOT_URL = minio_api_url
+    settings.POSTGRES_SERVER = settings.POSTGRES_TEST_SERVER
+    settings.POSTGRES_DB = settings.POSTGRES_TEST_DB
+    settings.DB_ECHO_LOG = False
+    settings.RECONCILE_INTERVAL = 0
+
+    from main import app
+    from utils.sessions import get_engine
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    async with get_engine().begin() as connection:
+        await connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        await connection.run_sync(SQLModel.metadata.drop_all)
+        await connection.run_sync(SQLModel.metadata.create_all)
+
+    await app.router.startup()
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url='http://bench') as client:
+            workload = Workload(client, IMAGE.read_bytes())
+            for _ in range(args.preload):
+                await workload.create()
+            levels = [
+                await run_level(workload, args.mix, concurrency, args.requests, args.seed)
+                for concurrency in args.concurrency
+            ]
+    finally:
+        await app.router.shutdown()
+        await get_engine().dispose()
+
+    return {
+        'benchmark': 'workload',
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'mix': args.mix,
+        'seed': args.seed,
+        'preload': args.preload,
+        's3_latency': args.s3_latency,
+        'levels': levels,
+    }
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=500, help='operations per concurrency level')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f'default: {DEFAULT_MIX}')
+    parser.add_argument('--preload', type=int, default=50, help='memes created before the first level')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--s3-latency', type=float, default=0.0, help='seconds the started S3 fake adds to every request')
+    parser.add_argument('--minio-api-url', help='URL of a running benchmarks.serve, e.g. http://minio_api:9100/api/')
+    parser.add_argument('--minio-api-dir', type=Path, default=MINIO_API_DIR)
+    parser.add_argument('--minio-python', default=sys.executable, help='interpreter with the minio_api dependencies')
+    add_result_arguments(parser, tolerance=0.15)
+    args = parser.parse_args()
+
+    process = None
+    url = args.minio_api_url
+    if url is None:
+        process, url = start_minio_api(args.minio_python, args.minio_api_dir, args.s3_latency)
+    try:
+        await wait_until_ready(url, process)
+        result = await run(args, url)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+    return report(result, args, compare)
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
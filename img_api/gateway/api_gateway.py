@@ -1,82 +1,377 @@
-from typing import BinaryIO
+import asyncio
+import base64
+from collections.abc import AsyncIterator, Awaitable, Callable
+import json
+import time
+from typing import Any
+from urllib.parse import unquote
 
 import aiohttp
+from fastapi import status, UploadFile
 
 from utils.config import settings
+from utils.errors import GatewayError
+from utils.metrics import GATEWAY_LATENCY, timed
+from utils.tracing import merge_server_timing, trace_headers
 
 
 class APIGateway:
     _api_root_url: str = settings.GW_ROOT_URL
     _user: str = settings.AUTH_USER
     _password: str = settings.AUTH_PASSWORD
+    _session: aiohttp.ClientSession | None = None
+    _token: str | None = None
+    _token_expires_at: float = 0.0
+    _token_lock: asyncio.Lock | None = None
 
     class Route:
         minio_route = 'minio/'
         auth_route = 'auth/token'
 
+    # Span names minio_api reports in its Server-Timing are merged under this prefix
+    _upstream_timing_prefix = 'minio_api.'
+
+    @classmethod
+    async def startup(cls) -> None:
+        """Open the pooled session shared by all gateway calls."""
+        await cls._get_session()
+
+    @classmethod
+    async def shutdown(cls) -> None:
+        """Close the pooled session and release its connections."""
+        if cls._session is not None and not cls._session.closed:
+            await cls._session.close()
+        cls._session = None
+        cls._token = None
+
+    @classmethod
+    async def _get_session(cls) -> aiohttp.ClientSession:
+        if cls._session is None or cls._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=settings.GW_POOL_LIMIT,
+                limit_per_host=settings.GW_POOL_LIMIT_PER_HOST,
+                keepalive_timeout=settings.GW_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=settings.GW_DNS_CACHE_TTL,
+            )
+            cls._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=settings.GW_REQUEST_TIMEOUT),
+            )
+        return cls._session
+
     @classmethod
     async def _build_url(cls, route: str, method: str = '') -> str:
         return f'{cls._api_root_url}{route}{method}'
 
+    @staticmethod
+    def _auth_headers(token: str | None) -> dict:
+        return {
+            'accept': 'application/json',
+            'Authorization': f'Bearer {token}'
+        }
+
+    @staticmethod
+    def _token_ttl(token: str) -> float:
+        """Seconds until the token's `exp` claim, or the default TTL if it has none."""
+        try:
+            payload = token.split('.')[1]
+            payload += '=' * (-len(payload) % 4)
+            exp = json.loads(base64.urlsafe_b64decode(payload)).get('exp')
+        except (IndexError, ValueError):
+            exp = None
+        if exp is None:
+            return settings.GW_TOKEN_DEFAULT_TTL
+        return exp - time.time()
+
     @classmethod
-    async def login_user(cls) -> dict:
-        async with aiohttp.ClientSession() as session:
-            url = await cls._build_url(cls.Route.auth_route)
-            payload = {
-                'username': settings.AUTH_USER,
-                'password': settings.AUTH_PASSWORD,
-            }
-            headers = {
-                'accept': 'application/json',
-                'Content-Type': 'application/x-www-form-urlencoded',
-            }
+    def _token_is_fresh(cls) -> bool:
+        return cls._token is not None and time.monotonic() < cls._token_expires_at
+
+    @classmethod
+    def _invalidate_token(cls, token: str | None) -> None:
+        if cls._token == token:
+            cls._token = None
+
+    @classmethod
+    @timed(GATEWAY_LATENCY, 'login')
+    async def _fetch_token(cls) -> str:
+        """Log in to minio_api; raise GatewayError if it refuses or sends no token."""
+        session = await cls._get_session()
+        url = await cls._build_url(cls.Route.auth_route)
+        payload = {
+            'username': settings.AUTH_USER,
+            'password': settings.AUTH_PASSWORD,
+        }
+        headers = {
+            'accept': 'application/json',
+            'Content-Type': 'application/x-www-form-urlencoded',
+            **trace_headers(),
+        }
+        try:
             async with session.post(url, data=payload, headers=headers) as resp:
+                merge_server_timing(resp.headers.get('Server-Timing'), cls._upstream_timing_prefix)
+                if not resp.ok:
+                    raise GatewayError(f'Storage API login responded with {resp.status}')
                 json_obj = await resp.json()
-                return {
-                    'accept': 'application/json',
-                    'Authorization': f'Bearer {json_obj.get("access_token")}'
-                }
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            raise GatewayError(f'Storage API login failed: {e}') from e
+        token = json_obj.get('access_token') if isinstance(json_obj, dict) else None
+        if not token:
+            raise GatewayError('Storage API login returned no access token')
+        return token
 
     @classmethod
+    async def login_user(cls) -> dict:
+        """Return auth headers, logging in only when the cached token is close to expiry.
+
+        Concurrent callers share a single in-flight login. A failed login raises GatewayError.
+        """
+        if not cls._token_is_fresh():
+            if cls._token_lock is None:
+                cls._token_lock = asyncio.Lock()
+            async with cls._token_lock:
+                if not cls._token_is_fresh():
+                    token = await cls._fetch_token()
+                    ttl = cls._token_ttl(token) - settings.GW_TOKEN_REFRESH_MARGIN
+                    cls._token = token
+                    cls._token_expires_at = time.monotonic() + max(ttl, 0)
+        return cls._auth_headers(cls._token)
+
+    @classmethod
+    async def _request(
+            cls,
+            method: str,
+            url: str,
+            data_factory: Callable[[], Awaitable[Any]] | None = None,
+            params: dict | None = None,
+            parse: Callable[[aiohttp.ClientResponse], Awaitable[Any]] | None = None,
+    ) -> Any:
+        """Send an authenticated request, logging in again once if the token is rejected.
+
+        The response is decoded as JSON unless a `parse` coroutine is given. The request id
+        is passed on, and minio_api's Server-Timing is merged into the current request's.
+        """
+        session = await cls._get_session()
+        for attempt in range(2):
+            headers = {**await cls.login_user(), **trace_headers()}
+            data = await data_factory() if data_factory else None
+            async with session.request(method, url, data=data, params=params, headers=headers) as resp:
+                merge_server_timing(resp.headers.get('Server-Timing'), cls._upstream_timing_prefix)
+                if resp.status == status.HTTP_401_UNAUTHORIZED and attempt == 0:
+                    cls._invalidate_token(headers['Authorization'].removeprefix('Bearer '))
+                    continue
+                return await parse(resp) if parse else await resp.json()
+
+    @staticmethod
+    async def _json_or_raise(resp: aiohttp.ClientResponse) -> Any:
+        if not resp.ok:
+            raise GatewayError(f'Storage API responded with {resp.status}')
+        return await resp.json()
+
+    @classmethod
+    async def _checked_request(
+            cls,
+            method: str,
+            url: str,
+            data_factory: Callable[[], Awaitable[Any]] | None = None,
+            params: dict | None = None,
+    ) -> dict:
+        """Like `_request`, but raise GatewayError if the call fails or is rejected."""
+        try:
+            return await cls._request(method, url, data_factory, params=params, parse=cls._json_or_raise)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise GatewayError(str(e)) from e
+
+    @staticmethod
+    async def _iter_chunks(file: UploadFile) -> AsyncIterator[bytes]:
+        while chunk := await file.read(settings.GW_UPLOAD_CHUNK_SIZE):
+            yield chunk
+
+    @classmethod
+    @timed(GATEWAY_LATENCY)
     async def create_or_update(
             cls,
-            file: BinaryIO,
+            file: UploadFile,
             description: str | None = None,
+            sha256: str | None = None,
     ) -> dict:
-        headers = await cls.login_user()
+        """Relay an upload to minio_api, streaming it from the spooled file in chunks.
+
+        A known `sha256` of the content is passed along, so minio_api need not hash it.
+        """
         url = f'{await cls._build_url(cls.Route.minio_route, "create_or_update")}'
 
-        data = aiohttp.FormData()
-        data.add_field('file', file.file.read(), filename=file.filename)
-        data.add_field('description', description)
+        async def build_form() -> aiohttp.FormData:
+            await file.seek(0)
+            data = aiohttp.FormData()
+            data.add_field(
+                'file',
+                cls._iter_chunks(file),
+                filename=file.filename,
+                content_type=file.content_type,
+            )
+            data.add_field('description', description)
+            if sha256 is not None:
+                data.add_field('sha256', sha256)
+            return data
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, data=data, headers=headers) as response:
-                return await response.json()
+        return await cls._checked_request('POST', url, build_form)
 
     @classmethod
+    @timed(GATEWAY_LATENCY)
+    async def copy_file(
+            cls,
+            source: str,
+            name: str,
+            description: str | None = None,
+            sha256: str | None = None,
+    ) -> dict:
+        """Copy an existing object to a new name inside the bucket, without re-uploading it.
+
+        With `sha256` the copy is refused unless the source still holds that content.
+        """
+        url = await cls._build_url(cls.Route.minio_route, 'copy')
+
+        async def build_form() -> aiohttp.FormData:
+            data = aiohttp.FormData()
+            data.add_field('source', source)
+            data.add_field('name', name)
+            data.add_field('description', description)
+            if sha256 is not None:
+                data.add_field('sha256', sha256)
+            return data
+
+        return await cls._checked_request('POST', url, build_form)
+
+    @classmethod
+    @timed(GATEWAY_LATENCY)
+    async def presign_upload(cls, name: str) -> dict:
+        """Get a URL the client can PUT the object to directly, bypassing both APIs."""
+        url = await cls._build_url(cls.Route.minio_route, 'presign_upload')
+        return await cls._checked_request('POST', url, params={'name': name})
+
+    @classmethod
+    @timed(GATEWAY_LATENCY)
+    async def presign_download(cls, name: str) -> dict:
+        """Get a URL the client can GET the object from directly, bypassing both APIs."""
+        url = await cls._build_url(cls.Route.minio_route, 'presign_download')
+        return await cls._checked_request('GET', url, params={'name': name})
+
+    @classmethod
+    @timed(GATEWAY_LATENCY)
+    async def stat_file(cls, name: str) -> dict | None:
+        """Return the object's info, or None if it is not in storage."""
+        url = await cls._build_url(cls.Route.minio_route, 'get')
+
+        async def parse(resp: aiohttp.ClientResponse) -> dict | None:
+            if resp.status == status.HTTP_404_NOT_FOUND:
+                return None
+            return await cls._json_or_raise(resp)
+
+        try:
+            return await cls._request('GET', url, params={'name': name}, parse=parse)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise GatewayError(str(e)) from e
+
+    @classmethod
+    @timed(GATEWAY_LATENCY)
+    async def open_file(
+            cls,
+            name: str,
+            range_header: str | None = None,
+            size: str | None = None,
+    ) -> aiohttp.ClientResponse:
+        """Start downloading an object, or its `size` rendition, and return the response
+        with its body still unread.
+
+        The caller must consume the body with `iter_content`, which releases the connection.
+        """
+        session = await cls._get_session()
+        url = await cls._build_url(cls.Route.minio_route, 'download')
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=settings.GW_REQUEST_TIMEOUT)
+        params = {'name': name}
+        if size is not None:
+            params['size'] = size
+        for attempt in range(2):
+            headers = {**await cls.login_user(), **trace_headers()}
+            if range_header is not None:
+                headers['Range'] = range_header
+            try:
+                resp = await session.get(url, params=params, headers=headers, timeout=timeout)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                raise GatewayError(str(e)) from e
+            merge_server_timing(resp.headers.get('Server-Timing'), cls._upstream_timing_prefix)
+            if resp.status == status.HTTP_401_UNAUTHORIZED and attempt == 0:
+                resp.release()
+                cls._invalidate_token(headers['Authorization'].removeprefix('Bearer '))
+                continue
+            return resp
+
+    @staticmethod
+    async def iter_content(resp: aiohttp.ClientResponse) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in resp.content.iter_chunked(settings.GW_DOWNLOAD_CHUNK_SIZE):
+                yield chunk
+        finally:
+            resp.release()
+
+    @classmethod
+    @timed(GATEWAY_LATENCY)
     async def get_file(cls, name: str) -> dict:
-        headers = await cls.login_user()
+        url = f'{await cls._build_url(cls.Route.minio_route, "get")}?name={name}'
+        return await cls._request('GET', url)
+
+    @classmethod
+    @timed(GATEWAY_LATENCY)
+    async def get_files_page(
+            cls,
+            start_after: str | None = None,
+            limit: int = settings.GW_LIST_PAGE_SIZE,
+    ) -> tuple[list[dict], str | None]:
+        """Fetch one page of files and the cursor of the next page, if any; raise
+        GatewayError if the listing fails or is rejected."""
+        url = await cls._build_url(cls.Route.minio_route, 'list')
+        params = {'limit': limit}
+        if start_after is not None:
+            params['start_after'] = start_after
 
-        async with aiohttp.ClientSession() as session:
-            url = f'{await cls._build_url(cls.Route.minio_route, "get")}?name={name}'
-            async with session.get(url, headers=headers) as resp:
-                return await resp.json()
+        async def parse(resp: aiohttp.ClientResponse) -> tuple[list[dict], str | None]:
+            next_start_after = resp.headers.get('X-Next-Start-After')
+            return await cls._json_or_raise(resp), unquote(next_start_after) if next_start_after else None
+
+        try:
+            return await cls._request('GET', url, params=params, parse=parse)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise GatewayError(str(e)) from e
 
     @classmethod
-    async def get_files(cls) -> dict:
-        headers = await cls.login_user()
+    async def iter_files(cls, limit: int = settings.GW_LIST_PAGE_SIZE) -> AsyncIterator[dict]:
+        """Walk the whole bucket page by page."""
+        start_after = None
+        while True:
+            files, start_after = await cls.get_files_page(start_after, limit)
+            for file in files:
+                yield file
+            if start_after is None:
+                break
 
-        async with aiohttp.ClientSession() as session:
-            url = await cls._build_url(cls.Route.minio_route, 'list')
-            async with session.get(url, headers=headers) as resp:
-                return await resp.json()
+    @classmethod
+    async def get_files(cls) -> list[dict]:
+        return [file async for file in cls.iter_files()]
 
     @classmethod
+    @timed(GATEWAY_LATENCY)
     async def delete_file(cls, name: str) -> dict:
-        headers = await cls.login_user()
+        url = f'{await cls._build_url(cls.Route.minio_route, "delete")}?name={name}'
+        return await cls._request('DELETE', url)
+
+    @classmethod
+    @timed(GATEWAY_LATENCY)
+    async def delete_files(cls, names: list[str]) -> dict:
+        """Delete many objects with multi-object delete requests; failures are listed per name."""
+        url = await cls._build_url(cls.Route.minio_route, 'delete_many')
+
+        async def build_body() -> aiohttp.JsonPayload:
+            return aiohttp.JsonPayload(names)
 
-        async with aiohttp.ClientSession() as session:
-            url = f'{await cls._build_url(cls.Route.minio_route, "delete")}?name={name}'
-            async with session.delete(url, headers=headers) as resp:
-                return await resp.json()
+        return await cls._checked_request('DELETE', url, build_body)
@@ -1,8 +1,14 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from gateway.api_gateway import APIGateway
 from utils.config import settings
+from utils.metrics import MetricsMiddleware, metrics_response
+from utils.sessions import check_database
+from utils.tracing import TracingMiddleware, exporter
 from routers import memes
+from workers.outbox import deletion_worker
+from workers.reconciliation import reconciliation_worker
 
 app = FastAPI(
     title=settings.TITLE,
@@ -30,9 +36,51 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=['*'],
     allow_headers=['*'],
+    expose_headers=['X-Request-ID', 'Server-Timing'],
 )
 
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware)
+
+
+@app.on_event('startup')
+async def check_db():
+    await check_database(retries=settings.DB_STARTUP_RETRIES)
+
+
+@app.on_event('startup')
+async def open_gateway():
+    await APIGateway.startup()
+
+
+@app.on_event('startup')
+async def start_workers():
+    deletion_worker.start()
+    reconciliation_worker.start()
+
+
+@app.on_event('shutdown')
+async def stop_workers():
+    await reconciliation_worker.stop()
+    await deletion_worker.stop()
+
+
+@app.on_event('shutdown')
+async def close_gateway():
+    await APIGateway.shutdown()
+
+
+@app.on_event('shutdown')
+async def flush_traces():
+    if exporter is not None:
+        exporter.shutdown()
+
 
 @app.get('/')
 async def root():
     return {'status': 'OK'}
+
+
+@app.get('/metrics', include_in_schema=False)
+async def metrics():
+    return metrics_response()
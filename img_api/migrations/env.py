@@ -10,6 +10,8 @@ from alembic import context
 
 from utils.config import settings
 from schemas.memes import Meme
+from schemas.outbox import DeletionOutbox
+from schemas.reconciliation import ReconciliationWatermark
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -0,0 +1,29 @@
+"""unique meme name
+
+Revision ID: 4b7e1c9a2f3d
+Revises: d95cbf22b68f
+Create Date: 2024-07-02 11:14:08.417503
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4b7e1c9a2f3d'
+down_revision: Union[str, None] = 'd95cbf22b68f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Keep only the latest row per name so the unique index can be built
+    op.execute('DELETE FROM memes a USING memes b WHERE a.name = b.name AND a.id < b.id')
+    op.create_index(op.f('ix_memes_name'), 'memes', ['name'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_memes_name'), table_name='memes')
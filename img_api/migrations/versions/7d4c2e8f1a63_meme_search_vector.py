@@ -0,0 +1,34 @@
+"""meme search vector
+
+Revision ID: 7d4c2e8f1a63
+Revises: 5a0d7e3c9b14
+Create Date: 2024-07-17 14:52:06.118734
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d4c2e8f1a63'
+down_revision: Union[str, None] = '5a0d7e3c9b14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('memes', sa.Column(
+        'search_vector',
+        postgresql.TSVECTOR(),
+        sa.Computed("to_tsvector('simple', coalesce(description, ''))", persisted=True),
+        nullable=True,
+    ))
+    op.create_index('ix_memes_search_vector', 'memes', ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_memes_search_vector', table_name='memes', postgresql_using='gin')
+    op.drop_column('memes', 'search_vector')
@@ -0,0 +1,37 @@
+"""meme name trigram index
+
+Revision ID: b8e5f0a2d7c9
+Revises: 7d4c2e8f1a63
+Create Date: 2024-07-18 09:37:12.604591
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8e5f0a2d7c9'
+down_revision: Union[str, None] = '7d4c2e8f1a63'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # Built without locking writes out, the table can be large
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_memes_name_trgm',
+            'memes',
+            ['name'],
+            unique=False,
+            postgresql_using='gin',
+            postgresql_ops={'name': 'gin_trgm_ops'},
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_memes_name_trgm', table_name='memes', postgresql_concurrently=True)
@@ -0,0 +1,26 @@
+"""meme is_committed
+
+Revision ID: c3f81b7d5e20
+Revises: 9e2d4a61c8b5
+Create Date: 2024-07-12 11:04:27.531902
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3f81b7d5e20'
+down_revision: Union[str, None] = '9e2d4a61c8b5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('memes', sa.Column('is_committed', sa.Boolean(), server_default=sa.true(), nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('memes', 'is_committed')
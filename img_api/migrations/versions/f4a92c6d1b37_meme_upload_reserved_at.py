@@ -0,0 +1,26 @@
+"""meme upload_reserved_at
+
+Revision ID: f4a92c6d1b37
+Revises: e61a9c3b5f08
+Create Date: 2024-07-22 10:41:06.318274
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f4a92c6d1b37'
+down_revision: Union[str, None] = 'e61a9c3b5f08'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('memes', sa.Column('upload_reserved_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('memes', 'upload_reserved_at')
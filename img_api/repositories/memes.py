@@ -1,15 +1,25 @@
-from collections.abc import Sequence
+import asyncio
+from collections.abc import AsyncIterator, Sequence
+from datetime import datetime
+import hashlib
+import math
 import logging
 import logging.config
-from typing import BinaryIO
 
-from sqlalchemy import select
+from aiohttp import ClientResponse
+from fastapi import UploadFile
+from sqlalchemy import and_, delete, func, literal, or_, select, update
+from sqlalchemy.dialects.postgresql import insert
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 from gateway.api_gateway import APIGateway
-from schemas.memes import Meme, MemeCreate, MemeRead, MemeUpdate
+from schemas.memes import Meme, MemeBatchItem, MemeCreate, MemeRead, MemeUpdate, MemeUpload
+from schemas.outbox import DeletionOutbox
+from utils.cache import meme_cache
 from utils.config import settings
-from utils.errors import EntityDoesNotExist, UnprocessableEntity
+from utils.errors import EntityDoesNotExist, GatewayError, StorageObjectMissing, UnprocessableEntity
+from utils.pagination import cursor_id, decode_cursor, encode_cursor
+from workers.outbox import deletion_worker
 
 logging.config.dictConfig(settings.LOGGING_CONFIG)
 
@@ -21,70 +31,361 @@ class MemeRepository:
         self.session = session
         self._model = Meme
         self._gateway = APIGateway
+        self._cache = meme_cache
+
+    @staticmethod
+    def _cache_key(model_id: int) -> str:
+        return f'meme:{model_id}'
 
     async def _add_to_db(self, new_item: Meme) -> None:
         self.session.add(new_item)
         await self.session.commit()
         await self.session.refresh(new_item)
 
-    async def _upsert(self, name: str, model_create: MemeCreate) -> MemeRead:
-        query = select(self._model).where(self._model.name == name)
-        result = await self.session.scalars(query)
-        result = result.first()
-        model_from_orm = self._model.from_orm(model_create)
+    async def _upsert(self, *models_create: MemeCreate) -> Sequence[Meme]:
+        """Insert the memes or update the rows with the same names in one statement."""
+        query = insert(self._model).values([model.dict() for model in models_create])
+        query = query.on_conflict_do_update(
+            index_elements=[self._model.name],
+            set_={
+                'description': query.excluded.description,
+                'last_updated_at': query.excluded.last_updated_at,
+                'sha256': query.excluded.sha256,
+                'is_committed': query.excluded.is_committed,
+                'upload_reserved_at': None,
+            },
+        )
+        result = await self.session.scalars(
+            query.returning(self._model),
+            execution_options={'populate_existing': True},
+        )
+        return result.all()
+
+    async def _cancel_deletions(self, *names: str) -> None:
+        """Drop queued storage deletions of names that are about to be written again.
 
-        if result is None:
-            result = model_from_orm
+        If the outbox worker holds them, this waits until its delete has gone through,
+        so the worker can never remove the new object. Uploads call it in a short
+        transaction before relaying the file, and again with their upsert, which drops
+        deletions queued while the file was on its way.
+        """
+        await self.session.execute(delete(DeletionOutbox).where(DeletionOutbox.name.in_(names)))
 
-        for k, v in model_from_orm.dict(exclude_unset=True).items():
-            setattr(result, k, v)
+    @staticmethod
+    async def _sha256(file: UploadFile) -> str:
+        """Hash the spooled upload; minio_api is sent the digest and does not read the file for it again."""
+        digest = hashlib.sha256()
+        await file.seek(0)
+        while chunk := await file.read(settings.GW_UPLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+        await file.seek(0)
+        return digest.hexdigest()
+
+    async def _find_duplicate(self, sha256: str, name: str) -> Meme | None:
+        """Find another meme with the same content, whose object can be copied instead of uploaded."""
+        query = (
+            select(self._model)
+            .where(self._model.sha256 == sha256, self._model.name != name, self._model.is_committed)
+            .limit(1)
+        )
+        result = await self.session.scalars(query)
+        return result.first()
 
-        return result
+    async def create(self, file: UploadFile, description: str) -> MemeRead | None:
+        """Store the image and save its meme.
 
-    async def create(self, file: BinaryIO, description: str) -> MemeRead | None:
+        Content already stored under another name is copied inside the bucket; minio_api
+        refuses the copy if that object no longer holds the same bytes, and the image is
+        then uploaded. An unchanged image under the same name is detected by minio_api.
+        """
         try:
-            minio_obj = await self._gateway.create_or_update(file, description)
+            sha256 = await self._sha256(file)
+            await self._cancel_deletions(file.filename)
+            duplicate = await self._find_duplicate(sha256, file.filename)
+            # No pooled connection stays checked out while the file is relayed to storage
+            await self.session.commit()
+            minio_obj = None
+            if duplicate is not None:
+                try:
+                    minio_obj = await self._gateway.copy_file(duplicate.name, file.filename, description, sha256)
+                except GatewayError as e:
+                    logger.info(f'Copy of {duplicate.name} refused, uploading {file.filename}: {e}')
+            if minio_obj is None:
+                minio_obj = await self._gateway.create_or_update(file, description, sha256)
             minio_obj.pop('status', None)
             model_create = MemeCreate(**minio_obj)
-            name = minio_obj.get('name')
-            new_item = await self._upsert(name, model_create)
-            await self._add_to_db(new_item)
-            logger.info(f'Image added: {name}')
+            await self._cancel_deletions(file.filename)
+            new_item, = await self._upsert(model_create)
+            await self.session.commit()
+            await self._cache.delete(self._cache_key(new_item.id))
+            logger.info(f'Image added: {new_item.name}')
             return new_item
         except UnprocessableEntity:
             raise
 
-    async def get(self, model_id: int) -> MemeRead:
+    async def create_many(
+            self,
+            files: Sequence[UploadFile],
+            descriptions: Sequence[str],
+    ) -> list[MemeBatchItem]:
+        """Upload files concurrently, then save every uploaded meme with one multi-row upsert.
+
+        Failed uploads are reported per item and do not stop the rest of the batch.
+        """
+        names = [file.filename for file in files]
+        await self._cancel_deletions(*names)
+        await self.session.commit()
+        semaphore = asyncio.Semaphore(settings.BATCH_UPLOAD_CONCURRENCY)
+
+        async def upload(file: UploadFile, description: str) -> dict | None:
+            async with semaphore:
+                try:
+                    return await self._gateway.create_or_update(file, description)
+                except GatewayError as e:
+                    logger.error(f'Batch upload failed for {file.filename}: {e}')
+                    return None
+
+        minio_objs = await asyncio.gather(*(
+            upload(file, description) for file, description in zip(files, descriptions)
+        ))
+
+        models_create = {}
+        for minio_obj in minio_objs:
+            if minio_obj is not None:
+                minio_obj.pop('status', None)
+                models_create[minio_obj['name']] = MemeCreate(**minio_obj)
+
+        items = {}
+        if models_create:
+            await self._cancel_deletions(*names)
+            items = {item.name: item for item in await self._upsert(*models_create.values())}
+            await self.session.commit()
+            await self._cache.delete(*(self._cache_key(item.id) for item in items.values()))
+            logger.info(f'Images added: {len(items)}')
+
+        return [
+            MemeBatchItem(filename=file.filename, status='created', meme=items[minio_obj['name']])
+            if minio_obj is not None
+            else MemeBatchItem(filename=file.filename, status='failed', detail='Upload to storage failed')
+            for file, minio_obj in zip(files, minio_objs)
+        ]
+
+    async def reserve_upload(self, name: str, description: str | None = None) -> MemeUpload:
+        """Register a meme whose image the client will PUT straight to storage.
+
+        A new name gets an uncommitted row, hidden until `commit_upload` confirms the
+        object. An existing meme keeps its row until then, but its image is replaced
+        as soon as the client's PUT lands, so its sha256 is cleared right away and no
+        upload is deduplicated against content storage may no longer hold. Reservations that are never committed are
+        dropped by the reconciliation after UPLOAD_RESERVATION_TTL seconds.
+        """
+        presigned = await self._gateway.presign_upload(name)
+        await self._cancel_deletions(name)
+        now = datetime.utcnow()
+        query = insert(self._model).values(
+            name=name,
+            description=description,
+            last_updated_at=now,
+            is_committed=False,
+            upload_reserved_at=now,
+        )
+        query = query.on_conflict_do_update(
+            index_elements=[self._model.name],
+            set_={'upload_reserved_at': query.excluded.upload_reserved_at, 'sha256': None},
+        )
+        result = await self.session.scalars(query.returning(self._model), execution_options={'populate_existing': True})
+        item = MemeRead.from_orm(result.one())
+        await self.session.commit()
+        logger.info(f'Upload reserved: {name}')
+        return MemeUpload(meme=item, upload_url=presigned['url'], expires_in=presigned['expires_in'])
+
+    async def commit_upload(self, model_id: int, description: str | None = None) -> MemeRead:
+        """Check that a directly uploaded image is in storage and publish its meme.
+
+        The object must have been written after the reservation: for an existing meme
+        storage still holds the previous image until the client's PUT replaces it.
+        """
+        item = await self.get(model_id)
+        await self.session.commit()
+        if description is None:
+            description = item.description
+        if item.upload_reserved_at is None:
+            raise StorageObjectMissing
+        minio_obj = await self._gateway.stat_file(item.name)
+        if minio_obj is None:
+            raise StorageObjectMissing
+        # Storage times have whole seconds; the row of a committed meme holds its object's time
+        stored_at = datetime.fromisoformat(minio_obj['last_updated_at'])
+        if stored_at < item.upload_reserved_at.replace(microsecond=0) or (
+                item.is_committed and stored_at == item.last_updated_at):
+            raise StorageObjectMissing
+        if minio_obj.get('description') != description:
+            # The presigned PUT carries no metadata, set it server-side without moving the bytes
+            minio_obj = await self._gateway.copy_file(item.name, item.name, description)
+        minio_obj.pop('status', None)
+        item, = await self._upsert(MemeCreate(**minio_obj))
+        await self.session.commit()
+        await self._cache.delete(self._cache_key(item.id))
+        logger.info(f'Upload committed: {item.name}')
+        return item
+
+    async def expire_reservations(self, before: datetime) -> int:
+        """Forget direct uploads reserved before `before` and never committed; return
+        how many hidden rows of new names were deleted.
+
+        An object the client did PUT is left in storage, where reconciliation finds it.
+        """
+        result = await self.session.execute(
+            delete(self._model).where(~self._model.is_committed, self._model.upload_reserved_at < before)
+        )
+        await self.session.execute(
+            update(self._model)
+            .where(self._model.is_committed, self._model.upload_reserved_at < before)
+            .values(upload_reserved_at=None)
+        )
+        await self.session.commit()
+        return result.rowcount
+
+    async def presign_image(self, model_id: int) -> dict:
+        """Return a URL the client can download the meme's image from directly."""
+        item = await self.get_cached(model_id)
+        return await self._gateway.presign_download(item.name)
+
+    async def get(self, model_id: int, committed_only: bool = False) -> MemeRead:
         query = select(self._model).where(self._model.id == model_id)
-        if result := await self.session.scalars(query):
-            return result.first()
+        if committed_only:
+            query = query.where(self._model.is_committed)
+        result = await self.session.scalars(query)
+        if item := result.first():
+            return item
         else:
             raise EntityDoesNotExist
 
-    async def list(self, offset: int = 0, limit: int = 50) -> Sequence[MemeRead]:
-        query = select(self._model).offset(offset).limit(limit)
+    async def get_cached(self, model_id: int) -> MemeRead:
+        """Read-through variant of `get` for the read path, served from the meme cache."""
+        key = self._cache_key(model_id)
+        if cached := await self._cache.get(key):
+            return MemeRead.model_validate_json(cached)
+        item = MemeRead.from_orm(await self.get(model_id, committed_only=True))
+        await self._cache.set(key, item.model_dump_json())
+        return item
+
+    async def open_image(
+            self,
+            model_id: int,
+            range_header: str | None = None,
+            size: str | None = None,
+    ) -> ClientResponse:
+        """Start streaming the meme's image, or a smaller rendition of it, from storage,
+        honouring an HTTP Range header."""
+        item = await self.get_cached(model_id)
+        return await self._gateway.open_file(item.name, range_header, size)
+
+    def iter_image(self, response: ClientResponse) -> AsyncIterator[bytes]:
+        return self._gateway.iter_content(response)
+
+    async def list(
+            self,
+            offset: int = 0,
+            limit: int = 50,
+            cursor: str | None = None,
+    ) -> tuple[Sequence[MemeRead], str | None]:
+        """Return a page of memes ordered by id and the cursor of the next page.
+
+        With a cursor the page is found by keyset on the primary key, so its cost
+        does not grow with depth; `offset` is only applied without a cursor.
+        """
+        query = (
+            select(self._model)
+            .where(self._model.is_committed)
+            .order_by(self._model.id)
+            .limit(limit + 1)
+        )
+        if cursor is not None:
+            query = query.where(self._model.id > cursor_id(decode_cursor(cursor)))
+        else:
+            query = query.offset(offset)
         results = await self.session.execute(query)
-        return results.scalars().all()
+        items = results.scalars().all()
+        next_cursor = encode_cursor({'id': items[limit - 1].id}) if len(items) > limit else None
+        return items[:limit], next_cursor
+
+    async def search(
+            self,
+            q: str,
+            limit: int = 50,
+            cursor: str | None = None,
+    ) -> tuple[Sequence[MemeRead], str | None]:
+        """Return a page of memes whose description matches `q`, best matches first,
+        and the cursor of the next page.
+
+        Matching goes through the GIN index on the description's tsvector, and pages
+        are found by keyset on (rank, id). The rank is computed per row, so every page
+        still ranks and sorts all matches; only the rows sent back are limited.
+        """
+        ts_query = func.websearch_to_tsquery('simple', q)
+        rank = func.ts_rank_cd(self._model.search_vector, ts_query)
+        query = (
+            select(self._model, rank)
+            .where(self._model.is_committed, self._model.search_vector.op('@@')(ts_query))
+            .order_by(rank.desc(), self._model.id)
+            .limit(limit + 1)
+        )
+        if cursor is not None:
+            position = decode_cursor(cursor)
+            last_rank, last_id = position.get('rank'), cursor_id(position)
+            if type(last_rank) not in (int, float) or not math.isfinite(last_rank):
+                raise UnprocessableEntity
+            query = query.where(or_(rank < last_rank, and_(rank == last_rank, self._model.id > last_id)))
+        rows = (await self.session.execute(query)).all()
+        next_cursor = None
+        if len(rows) > limit:
+            last_item, last_rank = rows[limit - 1]
+            next_cursor = encode_cursor({'rank': last_rank, 'id': last_item.id})
+        return [item for item, _ in rows[:limit]], next_cursor
+
+    async def lookup(self, name: str, limit: int = settings.LOOKUP_DEFAULT_LIMIT) -> Sequence[MemeRead]:
+        """Return up to `limit` memes whose names contain something similar to `name`, most similar first.
+
+        The `<%` word-similarity match is served by the trigram GIN index on the name,
+        so only the candidates it finds are ranked.
+        """
+        similarity = func.word_similarity(name, self._model.name)
+        query = (
+            select(self._model)
+            .where(self._model.is_committed, literal(name).op('<%')(self._model.name))
+            .order_by(similarity.desc(), func.similarity(name, self._model.name).desc(), self._model.id)
+            .limit(limit)
+        )
+        result = await self.session.scalars(query)
+        return result.all()
 
     async def update(self, model_id: int, model_update: MemeUpdate) -> MemeRead | None:
         if item := await self.get(model_id):
             item_dict = model_update.dict(
                 exclude_unset=True,
-                exclude={'id'},
+                exclude={'id', 'sha256', 'is_committed'},
             )
             for key, value in item_dict.items():
                 setattr(item, key, value)
             await self._add_to_db(item)
+            await self._cache.delete(self._cache_key(model_id))
             logger.info(f'Image updated: {model_update.name}')
             return item
         else:
             raise EntityDoesNotExist
 
     async def delete(self, model_id: int) -> None:
+        """Delete the meme and queue its image for deletion in the same transaction.
+
+        The object itself is removed later, in batches, by the deletion outbox worker.
+        """
         if result := await self.get(model_id):
-            await self._gateway.delete_file(result.name)
             await self.session.delete(result)
+            self.session.add(DeletionOutbox(name=result.name))
             await self.session.commit()
+            await self._cache.delete(self._cache_key(model_id))
+            deletion_worker.wake()
             logger.info(f'Image deleted: {result.name}')
         else:
             raise EntityDoesNotExist
@@ -1,10 +1,14 @@
+from collections import Counter
 from typing import Annotated, Optional
 
-from fastapi import APIRouter, Depends, File, Form, HTTPException, Query, status, UploadFile
+from fastapi import APIRouter, Depends, File, Form, Header, HTTPException, Query, Request, Response, status, UploadFile
+from fastapi.responses import StreamingResponse
 
 from repositories.memes import MemeRepository
-from schemas.memes import Meme, MemeCreate, MemeRead, MemeUpdate
-from utils.errors import EntityDoesNotExist
+from schemas.memes import Meme, MemeBatchItem, MemeCreate, MemeImageUrl, MemeRead, MemeUpdate, MemeUpload
+from utils.cache import etag_matches, make_etag
+from utils.config import settings
+from utils.errors import EntityDoesNotExist, GatewayError, StorageObjectMissing, UnprocessableEntity
 from utils.sessions import get_repository
 
 router = APIRouter(prefix='/memes')
@@ -21,7 +25,94 @@ async def create_meme(
         description: str = Form(),
         repository: MemeRepository = Depends(get_repository(MemeRepository)),
 ) -> MemeRead:
-    return await repository.create(file, description)
+    try:
+        return await repository.create(file, description)
+    except GatewayError:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=f'Could not upload {file.filename} to storage'
+        )
+
+
+@router.post(
+    '/batch',
+    response_model=list[MemeBatchItem],
+    status_code=status.HTTP_200_OK,
+    name='create_memes_batch',
+)
+async def create_memes_batch(
+        files: Annotated[list[UploadFile], File()],
+        descriptions: Annotated[list[str], Form()],
+        repository: MemeRepository = Depends(get_repository(MemeRepository)),
+) -> list[MemeBatchItem]:
+    if len(files) != len(descriptions):
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail='Each file needs exactly one description'
+        )
+    if len(files) > settings.BATCH_MAX_FILES:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f'At most {settings.BATCH_MAX_FILES} files per batch'
+        )
+    # Files with one name would be uploaded concurrently to the same object
+    duplicates = sorted(name for name, count in Counter(file.filename for file in files).items() if count > 1)
+    if duplicates:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f'Duplicate file names in batch: {", ".join(duplicates)}'
+        )
+    return await repository.create_many(files, descriptions)
+
+
+@router.post(
+    '/uploads',
+    response_model=MemeUpload,
+    status_code=status.HTTP_201_CREATED,
+    name='reserve_meme_upload',
+)
+async def reserve_meme_upload(
+        name: str = Form(),
+        description: str | None = Form(default=None),
+        repository: MemeRepository = Depends(get_repository(MemeRepository)),
+) -> MemeUpload:
+    try:
+        return await repository.reserve_upload(name, description)
+    except GatewayError:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=f'Could not get an upload URL for {name}'
+        )
+
+
+@router.post(
+    '/{meme_id}/commit',
+    response_model=MemeRead,
+    status_code=status.HTTP_200_OK,
+    name='commit_meme_upload',
+)
+async def commit_meme_upload(
+        meme_id: int,
+        description: str | None = Form(default=None),
+        repository: MemeRepository = Depends(get_repository(MemeRepository)),
+) -> MemeRead:
+    try:
+        return await repository.commit_upload(model_id=meme_id, description=description)
+    except EntityDoesNotExist:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f'Meme with ID={meme_id} not found'
+        )
+    except StorageObjectMissing:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f'Image of meme with ID={meme_id} has not been uploaded'
+        )
+    except GatewayError:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=f'Could not check image of meme with ID={meme_id}'
+        )
 
 
 @router.get(
@@ -31,14 +122,65 @@ async def create_meme(
     name='list_memes',
 )
 async def list_memes(
-        limit: int = Query(default=50, lte=100),
-        offset: int = Query(default=0),
+        response: Response,
+        limit: int = Query(default=50, ge=1, le=100),
+        offset: int = Query(default=0, ge=0),
+        cursor: str | None = Query(default=None),
         repository: MemeRepository = Depends(get_repository(MemeRepository)),
 ) -> Optional[MemeRead]:
-    return await repository.list(
-        limit=limit,
-        offset=offset,
-    )
+    try:
+        items, next_cursor = await repository.list(
+            limit=limit,
+            offset=offset,
+            cursor=cursor,
+        )
+    except UnprocessableEntity:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail='Invalid cursor'
+        )
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return items
+
+
+@router.get(
+    '/search',
+    response_model=list[MemeRead],
+    status_code=status.HTTP_200_OK,
+    name='search_memes',
+)
+async def search_memes(
+        response: Response,
+        q: str = Query(min_length=1),
+        limit: int = Query(default=50, ge=1, le=100),
+        cursor: str | None = Query(default=None),
+        repository: MemeRepository = Depends(get_repository(MemeRepository)),
+) -> list[MemeRead]:
+    try:
+        items, next_cursor = await repository.search(q, limit=limit, cursor=cursor)
+    except UnprocessableEntity:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail='Invalid cursor'
+        )
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return items
+
+
+@router.get(
+    '/lookup',
+    response_model=list[MemeRead],
+    status_code=status.HTTP_200_OK,
+    name='lookup_memes',
+)
+async def lookup_memes(
+        name: str = Query(min_length=1),
+        limit: int = Query(default=settings.LOOKUP_DEFAULT_LIMIT, gt=0, le=settings.LOOKUP_MAX_LIMIT),
+        repository: MemeRepository = Depends(get_repository(MemeRepository)),
+) -> list[MemeRead]:
+    return await repository.lookup(name, limit=limit)
 
 
 @router.get(
@@ -49,18 +191,110 @@ async def list_memes(
 )
 async def get_meme(
         meme_id: int,
+        request: Request,
+        response: Response,
         repository: MemeRepository = Depends(get_repository(MemeRepository)),
 ) -> MemeRead:
     try:
-        result = await repository.get(model_id=meme_id)
+        result = await repository.get_cached(model_id=meme_id)
     except EntityDoesNotExist:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f'Meme with ID={meme_id} not found'
         )
+    # Every field of the body takes part, so any change to the meme yields a new ETag
+    etag = make_etag(result.model_dump_json())
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+    response.headers['ETag'] = etag
     return result
 
 
+@router.get(
+    '/{meme_id}/image',
+    response_class=StreamingResponse,
+    status_code=status.HTTP_200_OK,
+    name='get_meme_image',
+)
+async def get_meme_image(
+        meme_id: int,
+        size: str | None = Query(default=None),
+        range_header: str | None = Header(default=None, alias='Range'),
+        repository: MemeRepository = Depends(get_repository(MemeRepository)),
+) -> StreamingResponse:
+    try:
+        resp = await repository.open_image(model_id=meme_id, range_header=range_header, size=size)
+    except EntityDoesNotExist:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f'Meme with ID={meme_id} not found'
+        )
+    except GatewayError:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=f'Could not download image of meme with ID={meme_id}'
+        )
+
+    if not resp.ok:
+        resp.release()
+        if resp.status == status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE:
+            raise HTTPException(
+                status_code=resp.status,
+                detail=f'Range {range_header} is outside the image',
+                headers={'Content-Range': resp.headers.get('Content-Range', '')},
+            )
+        if resp.status == status.HTTP_404_NOT_FOUND:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f'Image of meme with ID={meme_id} not found'
+            )
+        if resp.status == status.HTTP_422_UNPROCESSABLE_ENTITY:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=f'Image of meme with ID={meme_id} is not available in size {size}'
+            )
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=f'Could not download image of meme with ID={meme_id}'
+        )
+
+    headers = {
+        key: resp.headers[key]
+        for key in ('Content-Length', 'Content-Range', 'Accept-Ranges', 'ETag')
+        if key in resp.headers
+    }
+    return StreamingResponse(
+        repository.iter_image(resp),
+        status_code=resp.status,
+        headers=headers,
+        media_type=resp.headers.get('Content-Type'),
+    )
+
+
+@router.get(
+    '/{meme_id}/image_url',
+    response_model=MemeImageUrl,
+    status_code=status.HTTP_200_OK,
+    name='get_meme_image_url',
+)
+async def get_meme_image_url(
+        meme_id: int,
+        repository: MemeRepository = Depends(get_repository(MemeRepository)),
+) -> MemeImageUrl:
+    try:
+        return await repository.presign_image(model_id=meme_id)
+    except EntityDoesNotExist:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f'Meme with ID={meme_id} not found'
+        )
+    except GatewayError:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=f'Could not get a download URL for meme with ID={meme_id}'
+        )
+
+
 @router.delete(
     '/{meme_id}',
     status_code=status.HTTP_200_OK,
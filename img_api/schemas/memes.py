@@ -1,18 +1,33 @@
 from datetime import datetime
 
+from sqlalchemy import Column, Computed, Index
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlmodel import SQLModel, Field
 
 
 class MemeBase(SQLModel):
-    name: str
+    name: str = Field(index=True, unique=True)
     description: str | None = None
-    last_updated_at: datetime
+    last_updated_at: datetime = Field(index=True)
+    sha256: str | None = Field(default=None, index=True)
+    is_committed: bool = True
 
 
 class Meme(MemeBase, table=True):
     __tablename__ = 'memes'
+    __table_args__ = (
+        Index('ix_memes_search_vector', 'search_vector', postgresql_using='gin'),
+        Index('ix_memes_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+    )
 
     id: int | None = Field(primary_key=True, default=None)
+    # Set while a direct upload to storage is awaiting its commit
+    upload_reserved_at: datetime | None = None
+    # Kept up to date by Postgres itself; searched through the GIN index
+    search_vector: str | None = Field(
+        default=None,
+        sa_column=Column(TSVECTOR, Computed("to_tsvector('simple', coalesce(description, ''))", persisted=True)),
+    )
 
 
 class MemeCreate(MemeBase):
@@ -27,3 +42,21 @@ class MemeUpdate(MemeBase):
     name: str
     description: str | None
     last_updated_at: datetime
+
+
+class MemeBatchItem(SQLModel):
+    filename: str
+    status: str
+    meme: MemeRead | None = None
+    detail: str | None = None
+
+
+class MemeUpload(SQLModel):
+    meme: MemeRead
+    upload_url: str
+    expires_in: int
+
+
+class MemeImageUrl(SQLModel):
+    url: str
+    expires_in: int
@@ -0,0 +1,12 @@
+from datetime import datetime
+
+from sqlmodel import SQLModel, Field
+
+
+class DeletionOutbox(SQLModel, table=True):
+    __tablename__ = 'deletion_outbox'
+
+    id: int | None = Field(primary_key=True, default=None)
+    name: str = Field(index=True)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    attempts: int = 0
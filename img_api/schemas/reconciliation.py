@@ -0,0 +1,10 @@
+from datetime import datetime
+
+from sqlmodel import SQLModel, Field
+
+
+class ReconciliationWatermark(SQLModel, table=True):
+    __tablename__ = 'reconciliation_watermarks'
+
+    name: str = Field(primary_key=True)
+    value: datetime
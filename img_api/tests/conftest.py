@@ -5,12 +5,14 @@ from fastapi import FastAPI
 from httpx import AsyncClient, ASGITransport
 import pytest
 import pytest_asyncio
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlmodel import SQLModel
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 from utils.config import settings
+from utils.tracing import instrument_engine
 
 test_db = (
     f'postgresql+asyncpg://{settings.POSTGRES_USER}:{settings.POSTGRES_PASSWORD}'
@@ -22,6 +24,7 @@ engine = create_async_engine(
     echo=settings.DB_ECHO_LOG,
     future=True,
 )
+instrument_engine(engine.sync_engine)
 
 async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
@@ -36,6 +39,7 @@ def event_loop(request) -> Generator:
 @pytest_asyncio.fixture()
 async def db_session() -> AsyncSession:
     async with engine.begin() as connection:
+        await connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
         await connection.run_sync(SQLModel.metadata.drop_all)
         await connection.run_sync(SQLModel.metadata.create_all)
         async with async_session(bind=connection) as session:
@@ -44,6 +48,14 @@ async def db_session() -> AsyncSession:
             await session.rollback()
 
 
+@pytest_asyncio.fixture(autouse=True)
+async def clear_cache() -> AsyncGenerator:
+    from utils.cache import meme_cache
+
+    await meme_cache.clear()
+    yield
+
+
 @pytest.fixture()
 def override_get_db(db_session: AsyncSession) -> Callable:
     async def _override_get_db():
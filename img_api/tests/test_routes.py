@@ -1,11 +1,29 @@
+import asyncio
+from datetime import datetime
+import hashlib
 from pathlib import Path
+import time
 
+from prometheus_client import REGISTRY
 import pytest
+from sqlalchemy import exc, func, text
+from sqlmodel import select
 
+from gateway.api_gateway import APIGateway
+from schemas.memes import Meme
+from schemas.outbox import DeletionOutbox
+from schemas.reconciliation import ReconciliationWatermark
+from tests.conftest import engine, test_db
+from utils.config import settings
+from utils.errors import GatewayError
+from utils.sessions import check_database, create_db_engine
+from workers.outbox import DeletionOutboxWorker
+from workers.reconciliation import RECONCILIATION_LOCK_ID, Reconciler
 
-async def upload_img(async_client):
+
+async def upload_img(async_client, name: str = 'shark.jpg'):
     _test_upload_file = Path('tests/img', 'shark.jpg')
-    _files = {'file': _test_upload_file.open('rb')}
+    _files = {'file': (name, _test_upload_file.open('rb'), 'image/jpeg')}
 
     response = await async_client.post(
         'api/memes/',
@@ -27,6 +45,88 @@ async def test_list(async_client):
     assert response.status_code == 200
 
 
+@pytest.mark.asyncio
+async def test_list_cursor(async_client):
+    await upload_img(async_client)
+
+    response = await async_client.get(
+        'api/memes/?limit=1',
+    )
+    next_cursor = response.headers.get('X-Next-Cursor')
+
+    assert response.status_code == 200
+    assert len(response.json()) == 1
+    assert next_cursor is None
+
+
+@pytest.mark.asyncio
+async def test_list_cursor_pages(async_client):
+    for name in ('page-1.jpg', 'page-2.jpg', 'page-3.jpg'):
+        await upload_img(async_client, name)
+
+    first = await async_client.get(
+        'api/memes/?limit=2',
+    )
+    second = await async_client.get(
+        'api/memes/',
+        params={'limit': 2, 'cursor': first.headers['X-Next-Cursor']},
+    )
+    ids = [item['id'] for item in first.json() + second.json()]
+
+    assert len(first.json()) == 2
+    assert 'X-Next-Cursor' not in second.headers
+    assert ids == sorted(set(ids))
+    assert len(ids) == 3
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('query', ['cursor=invalid', 'cursor=eyJpZCI6IDEwMDAwMDAwMDAwMDAwMDAwMDAwMDB9', 'limit=0', 'limit=-1'])
+async def test_list_invalid_cursor(async_client, query):
+    response = await async_client.get(
+        f'api/memes/?{query}',
+    )
+
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('query', ['limit=0', 'cursor=eyJyYW5rIjogMC4xLCAiaWQiOiAxMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwfQ'])
+async def test_search_invalid_page(async_client, query):
+    response = await async_client.get(
+        f'api/memes/search?q=test&{query}',
+    )
+
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_search(async_client):
+    await upload_img(async_client)
+
+    response = await async_client.get(
+        'api/memes/search?q=test',
+    )
+    response_miss = await async_client.get(
+        'api/memes/search?q=dolphin',
+    )
+
+    assert response.status_code == 200
+    assert [meme['name'] for meme in response.json()] == ['shark.jpg']
+    assert response_miss.json() == []
+
+
+@pytest.mark.asyncio
+async def test_lookup(async_client):
+    await upload_img(async_client)
+
+    response = await async_client.get(
+        'api/memes/lookup?name=shar',
+    )
+
+    assert response.status_code == 200
+    assert [meme['name'] for meme in response.json()] == ['shark.jpg']
+
+
 @pytest.mark.asyncio
 async def test_create(async_client):
     response = await upload_img(async_client)
@@ -34,6 +134,111 @@ async def test_create(async_client):
     assert response.status_code == 201
 
 
+@pytest.mark.asyncio
+async def test_create_duplicate(async_client):
+    response = await upload_img(async_client)
+    response_duplicate = await upload_img(async_client)
+
+    assert response_duplicate.status_code == 201
+    assert response_duplicate.json().get('id') == response.json().get('id')
+    assert response_duplicate.json().get('sha256') is not None
+
+
+@pytest.mark.asyncio
+async def test_create_copies_duplicate(async_client):
+    response = await upload_img(async_client)
+    response_copy = await upload_img(async_client, 'shark-copy.jpg')
+
+    assert response_copy.status_code == 201
+    assert response_copy.json()['id'] != response.json()['id']
+    assert response_copy.json()['sha256'] == response.json()['sha256']
+
+
+@pytest.mark.asyncio
+async def test_create_duplicate_of_replaced_object(async_client, db_session):
+    content = Path('tests/img', 'shark.jpg').read_bytes() + b'\0'
+    await upload_img(async_client)
+    # The row still claims content that storage no longer holds, e.g. after a direct upload
+    meme = await db_session.scalar(select(Meme))
+    meme.sha256 = hashlib.sha256(content).hexdigest()
+    await db_session.commit()
+
+    response = await async_client.post(
+        'api/memes/',
+        files={'file': ('shark-copy.jpg', content, 'image/jpeg')},
+        data={'description': 'test'},
+    )
+    stored = await APIGateway.stat_file('shark-copy.jpg')
+
+    assert response.status_code == 201
+    assert stored['sha256'] == hashlib.sha256(content).hexdigest()
+
+
+@pytest.mark.asyncio
+async def test_create_restores_missing_object(async_client):
+    await upload_img(async_client)
+    await APIGateway.delete_files(['shark.jpg'])
+
+    response = await upload_img(async_client)
+
+    assert response.status_code == 201
+    assert await APIGateway.stat_file('shark.jpg') is not None
+
+
+@pytest.mark.parametrize('change', ['description', 'content'])
+@pytest.mark.asyncio
+async def test_create_existing_name(async_client, change):
+    content = Path('tests/img', 'shark.jpg').read_bytes()
+    created = (await upload_img(async_client)).json()
+    # Storage times have whole seconds
+    await asyncio.sleep(1)
+
+    description = 'updated' if change == 'description' else 'test'
+    if change == 'content':
+        content += b'\0'
+    response = await async_client.post(
+        'api/memes/',
+        files={'file': ('shark.jpg', content, 'image/jpeg')},
+        data={'description': description},
+    )
+    updated = (await async_client.get(f'api/memes/{created["id"]}')).json()
+
+    assert response.status_code == 201
+    assert updated['id'] == response.json()['id'] == created['id']
+    assert updated['description'] == description
+    assert (updated['sha256'] != created['sha256']) == (change == 'content')
+    assert updated['last_updated_at'] > created['last_updated_at']
+
+
+@pytest.mark.asyncio
+async def test_create_batch(async_client):
+    _test_upload_file = Path('tests/img', 'shark.jpg')
+    _files = [('files', _test_upload_file.open('rb'))]
+
+    response = await async_client.post(
+        'api/memes/batch',
+        files=_files,
+        data={'descriptions': ['test']},
+    )
+
+    assert response.status_code == 200
+    assert response.json()[0].get('status') == 'created'
+
+
+@pytest.mark.asyncio
+async def test_create_batch_duplicate_names(async_client):
+    _test_upload_file = Path('tests/img', 'shark.jpg')
+    _files = [('files', ('shark.jpg', _test_upload_file.open('rb'))) for _ in range(2)]
+
+    response = await async_client.post(
+        'api/memes/batch',
+        files=_files,
+        data={'descriptions': ['first', 'second']},
+    )
+
+    assert response.status_code == 422
+
+
 @pytest.mark.asyncio
 async def test_get(async_client):
     await upload_img(async_client)
@@ -45,6 +250,111 @@ async def test_get(async_client):
     assert response.status_code == 200
 
 
+@pytest.mark.asyncio
+async def test_get_not_modified(async_client):
+    await upload_img(async_client)
+
+    response = await async_client.get(
+        'api/memes/1',
+    )
+    response_cached = await async_client.get(
+        'api/memes/1',
+        headers={'If-None-Match': response.headers['ETag']},
+    )
+
+    assert response.status_code == 200
+    assert response_cached.status_code == 304
+
+
+@pytest.mark.asyncio
+async def test_get_modified_after_rename(async_client):
+    meme = (await upload_img(async_client)).json()
+    response = await async_client.get(
+        'api/memes/1',
+    )
+
+    await async_client.put(
+        'api/memes/1',
+        json={'name': 'renamed.jpg', 'description': meme['description'], 'last_updated_at': meme['last_updated_at']},
+    )
+    response_renamed = await async_client.get(
+        'api/memes/1',
+        headers={'If-None-Match': response.headers['ETag']},
+    )
+
+    assert response_renamed.status_code == 200
+    assert response_renamed.json()['name'] == 'renamed.jpg'
+
+
+@pytest.mark.asyncio
+async def test_get_image(async_client):
+    await upload_img(async_client)
+
+    response = await async_client.get(
+        'api/memes/1/image',
+        headers={'Range': 'bytes=0-9'},
+    )
+
+    assert response.status_code == 206
+    assert response.content == Path('tests/img', 'shark.jpg').read_bytes()[:10]
+
+
+@pytest.mark.asyncio
+async def test_get_image_thumbnail(async_client):
+    await upload_img(async_client)
+
+    response = await async_client.get(
+        'api/memes/1/image?size=thumb',
+    )
+
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'image/webp'
+
+
+@pytest.mark.asyncio
+async def test_reserve_upload(async_client):
+    response = await async_client.post(
+        'api/memes/uploads',
+        data={'name': 'presigned.jpg', 'description': 'test'},
+    )
+    response_get = await async_client.get(
+        f'api/memes/{response.json()["meme"]["id"]}',
+    )
+
+    assert response.status_code == 201
+    assert response.json()['upload_url']
+    assert response_get.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_commit_missing_upload(async_client):
+    response = await async_client.post(
+        'api/memes/uploads',
+        data={'name': 'presigned.jpg', 'description': 'test'},
+    )
+    response_commit = await async_client.post(
+        f'api/memes/{response.json()["meme"]["id"]}/commit',
+    )
+
+    assert response_commit.status_code == 409
+
+
+@pytest.mark.asyncio
+async def test_commit_existing_meme_without_upload(async_client):
+    response = await upload_img(async_client)
+    response_reserve = await async_client.post(
+        'api/memes/uploads',
+        data={'name': 'shark.jpg', 'description': 'replaced'},
+    )
+    response_commit = await async_client.post(
+        f'api/memes/{response.json()["id"]}/commit',
+    )
+
+    assert response_reserve.json()['meme']['id'] == response.json()['id']
+    assert response_reserve.json()['meme']['sha256'] is None
+    assert response_commit.status_code == 409
+
+
 @pytest.mark.asyncio
 async def test_delete(async_client):
     await upload_img(async_client)
@@ -56,6 +366,109 @@ async def test_delete(async_client):
     assert response.status_code == 200
 
 
+@pytest.mark.asyncio
+async def test_delete_drains_outbox(async_client, db_session):
+    await upload_img(async_client)
+    await async_client.delete(
+        'api/memes/1',
+    )
+
+    queued = (await db_session.scalars(select(DeletionOutbox.name))).all()
+    deleted = await DeletionOutboxWorker().drain(db_session)
+    remaining = (await db_session.scalars(select(DeletionOutbox.name))).all()
+
+    assert queued == ['shark.jpg']
+    assert deleted == 1
+    assert remaining == []
+
+
+@pytest.mark.asyncio
+async def test_outbox_parks_failing_entries(db_session, monkeypatch):
+    async def delete_files(names):
+        raise GatewayError('minio_api is down')
+
+    monkeypatch.setattr(APIGateway, 'delete_files', delete_files)
+    db_session.add(DeletionOutbox(name='cat.png'))
+    await db_session.commit()
+    worker = DeletionOutboxWorker(max_attempts=2)
+
+    for _ in range(3):
+        await worker.drain(db_session)
+    entry = await db_session.scalar(select(DeletionOutbox))
+
+    assert entry.attempts == 2
+
+
+def fake_bucket(monkeypatch, objects: dict[str, datetime]):
+    async def iter_files(limit):
+        for name in sorted(objects):
+            yield {'name': name, 'last_updated_at': objects[name].isoformat()}
+
+    async def stat_file(name):
+        return {'name': name} if name in objects else None
+
+    monkeypatch.setattr(APIGateway, 'iter_files', iter_files)
+    monkeypatch.setattr(APIGateway, 'stat_file', stat_file)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('repair', [False, True])
+async def test_reconcile_orphan_row(db_session, monkeypatch, repair):
+    fake_bucket(monkeypatch, {'cat.png': datetime(2024, 1, 1)})
+    db_session.add(Meme(name='cat.png', last_updated_at=datetime(2024, 1, 1)))
+    db_session.add(Meme(name='shark.jpg', last_updated_at=datetime(2024, 1, 1)))
+    await db_session.commit()
+
+    report = await Reconciler(repair=repair, bind=db_session.bind).run()
+    names = (await db_session.scalars(select(Meme.name).order_by(Meme.name))).all()
+
+    assert report['orphan_rows'] == 1
+    assert report['repaired'] == int(repair)
+    assert names == (['cat.png'] if repair else ['cat.png', 'shark.jpg'])
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('repair', [False, True])
+async def test_reconcile_orphan_object(db_session, monkeypatch, repair):
+    fake_bucket(monkeypatch, {'cat.png': datetime(2024, 1, 1), 'dog.png': datetime(2024, 1, 1)})
+    db_session.add(DeletionOutbox(name='dog.png'))
+    await db_session.commit()
+
+    report = await Reconciler(repair=repair, bind=db_session.bind).run()
+    queued = (await db_session.scalars(select(DeletionOutbox.name).order_by(DeletionOutbox.name))).all()
+
+    assert report['orphan_objects'] == 1
+    assert queued == (['cat.png', 'dog.png'] if repair else ['dog.png'])
+
+
+@pytest.mark.asyncio
+async def test_reconcile_fresh_meme_holds_watermark(db_session, monkeypatch):
+    fresh = datetime.utcnow()
+    fake_bucket(monkeypatch, {'cat.png': datetime(2024, 1, 1), 'shark.jpg': fresh})
+    db_session.add(Meme(name='cat.png', last_updated_at=datetime(2024, 1, 1)))
+    db_session.add(Meme(name='shark.jpg', last_updated_at=fresh, is_committed=False))
+    await db_session.commit()
+
+    report = await Reconciler(bind=db_session.bind).run()
+    watermark = await db_session.get(ReconciliationWatermark, Reconciler.watermark_name)
+
+    assert report['checked'] == 2
+    assert report['orphan_rows'] == 0
+    assert datetime(2024, 1, 1) <= watermark.value < fresh
+
+
+@pytest.mark.asyncio
+async def test_reconcile_skipped_while_locked(db_session, monkeypatch):
+    fake_bucket(monkeypatch, {})
+
+    async with engine.connect() as connection:
+        await connection.execute(select(func.pg_advisory_xact_lock(RECONCILIATION_LOCK_ID)))
+        report = await Reconciler(bind=db_session.bind).run()
+
+    assert report['skipped'] is True
+    assert report['checked'] == 0
+
+
 @pytest.mark.asyncio
 async def test_update(async_client):
     await upload_img(async_client)
@@ -66,3 +479,125 @@ async def test_update(async_client):
     )
 
     assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_metrics(async_client):
+    await async_client.get(
+        'api/memes/',
+    )
+
+    response = await async_client.get(
+        'metrics',
+    )
+
+    assert response.status_code == 200
+    assert 'http_request_duration_seconds_count{method="GET",route="/api/memes/",status="200"}' in response.text
+
+
+@pytest.mark.asyncio
+async def test_server_timing(async_client):
+    await upload_img(async_client)
+
+    response = await async_client.get(
+        'api/memes/1/image',
+        headers={'X-Request-ID': 'test-request'},
+    )
+
+    assert response.headers['X-Request-ID'] == 'test-request'
+    assert 'db;dur=' in response.headers['Server-Timing']
+    assert 'open_file;dur=' in response.headers['Server-Timing']
+    assert 'minio_api.total;dur=' in response.headers['Server-Timing']
+
+
+@pytest.mark.asyncio
+async def test_database_pool(monkeypatch):
+    monkeypatch.setattr(settings, 'DB_POOL_SIZE', 1)
+    monkeypatch.setattr(settings, 'DB_MAX_OVERFLOW', 0)
+    monkeypatch.setattr(settings, 'DB_POOL_TIMEOUT', 0.1)
+    engine = create_db_engine(test_db)
+    try:
+        stats = await check_database(engine)
+        assert stats == {'size': 1, 'checked_in': 1, 'checked_out': 0, 'overflow': 0}
+
+        timeouts = REGISTRY.get_sample_value('db_pool_timeouts_total')
+        async with engine.connect():
+            with pytest.raises(exc.TimeoutError):
+                await check_database(engine)
+        assert REGISTRY.get_sample_value('db_pool_timeouts_total') == timeouts + 1
+    finally:
+        await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_database_without_statement_cache(monkeypatch):
+    monkeypatch.setattr(settings, 'DB_STATEMENT_CACHE_SIZE', 0)
+    engine = create_db_engine(test_db)
+    try:
+        async with engine.connect() as connection:
+            for value in (1, 2):
+                assert await connection.scalar(text('SELECT CAST(:value AS integer)'), {'value': value}) == value
+    finally:
+        await engine.dispose()
+
+
+@pytest.fixture()
+def fake_login(monkeypatch):
+    logins = []
+
+    async def fetch_token():
+        logins.append(None)
+        await asyncio.sleep(0.01)
+        return f'token-{len(logins)}'
+
+    monkeypatch.setattr(APIGateway, '_fetch_token', fetch_token)
+    monkeypatch.setattr(APIGateway, '_token', None)
+    return logins
+
+
+@pytest.mark.asyncio
+async def test_gateway_reuses_token(fake_login):
+    first = await APIGateway.login_user()
+    second = await APIGateway.login_user()
+
+    assert first['Authorization'] == second['Authorization'] == 'Bearer token-1'
+    assert len(fake_login) == 1
+
+
+@pytest.mark.asyncio
+async def test_gateway_shares_token_refresh(fake_login):
+    headers = await asyncio.gather(*(APIGateway.login_user() for _ in range(5)))
+
+    assert {item['Authorization'] for item in headers} == {'Bearer token-1'}
+    assert len(fake_login) == 1
+
+
+@pytest.mark.asyncio
+async def test_gateway_retries_rejected_token(monkeypatch):
+    monkeypatch.setattr(APIGateway, '_token', 'expired')
+    monkeypatch.setattr(APIGateway, '_token_expires_at', time.monotonic() + 60)
+
+    result = await APIGateway.stat_file('missing.jpg')
+
+    assert result is None
+    assert APIGateway._token not in (None, 'expired')
+
+
+@pytest.mark.asyncio
+async def test_gateway_login_failure(monkeypatch):
+    monkeypatch.setattr(APIGateway, '_token', None)
+    monkeypatch.setattr(settings, 'AUTH_PASSWORD', 'wrong')
+
+    with pytest.raises(GatewayError):
+        await APIGateway.login_user()
+
+
+@pytest.mark.asyncio
+async def test_gateway_list_rejected(monkeypatch):
+    async def login_user():
+        return {'Authorization': 'Bearer invalid'}
+
+    monkeypatch.setattr(APIGateway, 'login_user', login_user)
+
+    with pytest.raises(GatewayError):
+        await APIGateway.get_files_page()
@@ -0,0 +1,85 @@
+from collections import OrderedDict
+import hashlib
+import time
+
+from utils.config import settings
+
+
+class MemoryCache:
+    """In-process LRU cache whose entries expire `ttl` seconds after they are set."""
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[str, tuple[float, str]] = OrderedDict()
+
+    async def get(self, key: str) -> str | None:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: str) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    async def delete(self, *keys: str) -> None:
+        for key in keys:
+            self._data.pop(key, None)
+
+    async def clear(self) -> None:
+        self._data.clear()
+
+
+class RedisCache:
+    """Cache shared by all workers, kept in Redis. Needs the optional `redis` package."""
+
+    def __init__(self, url: str, ttl: float, prefix: str = 'img_api:') -> None:
+        from redis import asyncio as aioredis
+
+        self.ttl = ttl
+        self.prefix = prefix
+        self._client = aioredis.from_url(url, decode_responses=True)
+
+    async def get(self, key: str) -> str | None:
+        return await self._client.get(self.prefix + key)
+
+    async def set(self, key: str, value: str) -> None:
+        await self._client.set(self.prefix + key, value, px=int(self.ttl * 1000))
+
+    async def delete(self, *keys: str) -> None:
+        if keys:
+            await self._client.delete(*(self.prefix + key for key in keys))
+
+    async def clear(self) -> None:
+        async for key in self._client.scan_iter(f'{self.prefix}*'):
+            await self._client.delete(key)
+
+
+def build_cache() -> MemoryCache | RedisCache:
+    if settings.CACHE_URL:
+        return RedisCache(settings.CACHE_URL, settings.CACHE_TTL)
+    return MemoryCache(settings.CACHE_MAXSIZE, settings.CACHE_TTL)
+
+
+def make_etag(*parts: object) -> str:
+    digest = hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Check an If-None-Match header against an ETag using weak comparison."""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates
+
+
+meme_cache = build_cache()
@@ -29,10 +29,52 @@ class Settings(BaseSettings):
     POSTGRES_TEST_DB: str = os.getenv('POSTGRES_TEST_DB')
     POSTGRES_TEST_PORT: str = os.getenv('POSTGRES_TEST_PORT')
     DB_ECHO_LOG: bool = True if os.getenv('DEBUG') == 'True' else False
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = os.getenv('DB_POOL_PRE_PING', 'True') == 'True'
+    DB_CONNECT_TIMEOUT: float = 10.0
+    DB_STATEMENT_CACHE_SIZE: int = 100
+    DB_STARTUP_RETRIES: int = 5
 
     GW_ROOT_URL: str = os.getenv('GW_ROOT_URL')
     AUTH_USER: str = os.getenv('AUTH_USER')
     AUTH_PASSWORD: str = os.getenv('AUTH_PASSWORD')
+    GW_POOL_LIMIT: int = 100
+    GW_POOL_LIMIT_PER_HOST: int = 50
+    GW_KEEPALIVE_TIMEOUT: float = 30.0
+    GW_DNS_CACHE_TTL: int = 300
+    GW_REQUEST_TIMEOUT: float = 60.0
+    GW_TOKEN_REFRESH_MARGIN: int = 30
+    GW_TOKEN_DEFAULT_TTL: int = 300
+    GW_UPLOAD_CHUNK_SIZE: int = 64 * 1024
+    GW_DOWNLOAD_CHUNK_SIZE: int = 64 * 1024
+    GW_LIST_PAGE_SIZE: int = 1000
+
+    CACHE_URL: str | None = os.getenv('CACHE_URL')
+    CACHE_TTL: float = 60.0
+    CACHE_MAXSIZE: int = 10000
+
+    BATCH_MAX_FILES: int = 100
+    BATCH_UPLOAD_CONCURRENCY: int = 8
+    UPLOAD_RESERVATION_TTL: int = 24 * 3600
+
+    LOOKUP_DEFAULT_LIMIT: int = 10
+    LOOKUP_MAX_LIMIT: int = 100
+
+    OUTBOX_BATCH_SIZE: int = 500
+    OUTBOX_POLL_INTERVAL: float = 5.0
+    OUTBOX_MAX_ATTEMPTS: int = 10
+
+    RECONCILE_INTERVAL: float = 3600.0
+    RECONCILE_REPAIR: bool = True if os.getenv('RECONCILE_REPAIR') == 'True' else False
+    RECONCILE_GRACE_SECONDS: int = 300
+    RECONCILE_BATCH_SIZE: int = 1000
+    RECONCILE_FULL_EVERY: int = 24
+
+    OTLP_ENDPOINT: str | None = os.getenv('OTLP_ENDPOINT')
+    OTLP_SERVICE_NAME: str = 'img_api'
 
     LOGGING_CONFIG: dict = {
         "version": 1,
@@ -11,3 +11,13 @@ class EntityAlreadyExists(Exception):
 class UnprocessableEntity(Exception):
     """Raised when an unprocessable entity is provided."""
     pass
+
+
+class GatewayError(Exception):
+    """Raised when a request to the storage API fails."""
+    pass
+
+
+class StorageObjectMissing(Exception):
+    """Raised when an object expected in storage was not found there."""
+    pass
@@ -0,0 +1,138 @@
+from collections.abc import Awaitable, Callable
+import functools
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, REGISTRY, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, Pool
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from utils.tracing import record_span
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds',
+    'Time spent handling HTTP requests, by route template.',
+    ['method', 'route', 'status'],
+)
+
+GATEWAY_LATENCY = Histogram(
+    'gateway_request_duration_seconds',
+    'Time spent in APIGateway calls to minio_api, by gateway method.',
+    ['method'],
+)
+
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    'db_pool_checkout_wait_seconds',
+    'Time spent waiting for a connection from the SQLAlchemy pool.',
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+DB_POOL_TIMEOUTS = Counter(
+    'db_pool_timeouts',
+    'Checkouts that gave up after DB_POOL_TIMEOUT because the pool and its overflow were in use.',
+)
+
+
+class MetricsMiddleware:
+    """Record the latency of every HTTP request under its route template, e.g. `/api/memes/{meme_id}`."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        status_code = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router stores the matched route in the scope; unmatched paths share one label
+            route = scope.get('route')
+            REQUEST_LATENCY.labels(
+                scope['method'],
+                route.path if route is not None else 'unmatched',
+                status_code,
+            ).observe(time.perf_counter() - start)
+
+
+def timed(histogram: Histogram, name: str | None = None) -> Callable:
+    """Decorate a coroutine function to observe its duration in `histogram`, labelled by name.
+
+    The call is also recorded as a span of the current request under the same name.
+    """
+    def decorator(func: Callable[..., Awaitable]) -> Callable[..., Awaitable]:
+        label = name or func.__name__
+        metric = histogram.labels(label)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                end = time.perf_counter()
+                metric.observe(end - start)
+                record_span(label, start, end)
+
+        return wrapper
+
+    return decorator
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """Async queue pool that records how long each connection checkout waited."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            DB_POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            DB_POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start)
+
+
+def pool_stats(pool: Pool) -> dict:
+    return {
+        'size': pool.size(),
+        'checked_in': pool.checkedin(),
+        'checked_out': pool.checkedout(),
+        'overflow': max(pool.overflow(), 0),
+    }
+
+
+class PoolCollector(Collector):
+    """Report pool occupancy at scrape time, so it costs nothing on the request path."""
+
+    def __init__(self, pools: dict[str, Pool]) -> None:
+        self.pools = pools
+
+    def collect(self):
+        size = GaugeMetricFamily('db_pool_size', 'Connections the pool keeps open.', labels=['engine'])
+        checked_in = GaugeMetricFamily('db_pool_checked_in', 'Idle connections in the pool.', labels=['engine'])
+        checked_out = GaugeMetricFamily('db_pool_checked_out', 'Connections in use.', labels=['engine'])
+        overflow = GaugeMetricFamily('db_pool_overflow', 'Connections opened beyond the pool size.', labels=['engine'])
+        for name, pool in self.pools.items():
+            stats = pool_stats(pool)
+            size.add_metric([name], stats['size'])
+            checked_in.add_metric([name], stats['checked_in'])
+            checked_out.add_metric([name], stats['checked_out'])
+            overflow.add_metric([name], stats['overflow'])
+        yield from (size, checked_in, checked_out, overflow)
+
+
+def metrics_response() -> Response:
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
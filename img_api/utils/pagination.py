@@ -0,0 +1,32 @@
+import base64
+import binascii
+import json
+
+from utils.errors import UnprocessableEntity
+
+# Ids are Postgres integers; a forged cursor beyond them would fail the query instead of being rejected
+MAX_ID = 2 ** 31 - 1
+
+
+def encode_cursor(position: dict) -> str:
+    """Pack a keyset position into an opaque URL-safe cursor."""
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> dict:
+    """Unpack a cursor made by `encode_cursor`, raising UnprocessableEntity if it is malformed."""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise UnprocessableEntity
+    if not isinstance(position, dict):
+        raise UnprocessableEntity
+    return position
+
+
+def cursor_id(position: dict) -> int:
+    """Return the row id of a cursor position, raising UnprocessableEntity unless it is a valid one."""
+    last_id = position.get('id')
+    if type(last_id) is not int or not 0 <= last_id <= MAX_ID:
+        raise UnprocessableEntity
+    return last_id
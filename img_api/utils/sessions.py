@@ -1,42 +1,110 @@
 from typing import Generator
+import asyncio
 from asyncio import current_task
+import functools
+import logging
+import logging.config
+from uuid import uuid4
 
 from fastapi import Depends
-from sqlalchemy.ext.asyncio import create_async_engine, async_scoped_session
+from prometheus_client import REGISTRY
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, async_scoped_session
 from sqlalchemy.orm import sessionmaker
-from sqlmodel import Session, create_engine
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 from utils.config import settings
+from utils.metrics import InstrumentedQueuePool, PoolCollector, pool_stats
+from utils.tracing import instrument_engine
 
-engine = create_engine(
-    url=settings.sync_database_url,
-    echo=settings.DB_ECHO_LOG,
-)
-
-async_engine = create_async_engine(
-    url=settings.async_database_url,
-    echo=settings.DB_ECHO_LOG,
-    future=True,
-)
-
-async_session = async_scoped_session(
-    sessionmaker(
-        async_engine,
-        class_=AsyncSession,
-        expire_on_commit=False,
-    ),
-    scopefunc=current_task,
-)
-
-
-def get_session() -> Generator:
-    with Session(engine) as session:
-        yield session
+logging.config.dictConfig(settings.LOGGING_CONFIG)
+
+logger = logging.getLogger(__name__)
+
+
+def create_db_engine(url: str | None = None) -> AsyncEngine:
+    """Build an async engine whose pool is sized and timed by the DB_* settings.
+
+    Bursts beyond DB_POOL_SIZE open up to DB_MAX_OVERFLOW extra connections; a checkout
+    that still finds none free fails after DB_POOL_TIMEOUT seconds.
+    """
+    connect_args = {
+        'timeout': settings.DB_CONNECT_TIMEOUT,
+        # Statements SQLAlchemy keeps prepared per connection
+        'prepared_statement_cache_size': settings.DB_STATEMENT_CACHE_SIZE,
+    }
+    if settings.DB_STATEMENT_CACHE_SIZE == 0:
+        # Behind pgbouncer in transaction mode a server connection is shared between clients,
+        # so asyncpg's own cache is off too and every statement gets a name no one else uses
+        connect_args['statement_cache_size'] = 0
+        connect_args['prepared_statement_name_func'] = lambda: f'__asyncpg_{uuid4()}__'
+    return create_async_engine(
+        url=url or settings.async_database_url,
+        echo=settings.DB_ECHO_LOG,
+        future=True,
+        poolclass=InstrumentedQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        connect_args=connect_args,
+    )
+
+
+@functools.cache
+def get_engine() -> AsyncEngine:
+    """Return the application's engine, created on first use rather than at import.
+
+    Importing the app thus loads no database driver, and tests that override `get_db`
+    never create the engine at all.
+    """
+    engine = create_db_engine()
+    REGISTRY.register(PoolCollector({'async': engine.pool}))
+    instrument_engine(engine.sync_engine)
+    return engine
+
+
+@functools.cache
+def _scoped_session() -> async_scoped_session:
+    return async_scoped_session(
+        sessionmaker(
+            get_engine(),
+            class_=AsyncSession,
+            expire_on_commit=False,
+        ),
+        scopefunc=current_task,
+    )
+
+
+def async_session() -> AsyncSession:
+    """Return the session of the current task."""
+    return _scoped_session()()
+
+
+async def check_database(engine: AsyncEngine | None = None, retries: int = 0) -> dict:
+    """Run `SELECT 1` on a pooled connection and return the pool statistics.
+
+    Failed attempts are retried once a second, so a database that is still starting is waited for.
+    """
+    engine = engine or get_engine()
+    for attempt in range(retries + 1):
+        try:
+            async with engine.connect() as connection:
+                await connection.execute(text('SELECT 1'))
+            break
+        except Exception as e:
+            if attempt == retries:
+                raise
+            logger.warning(f'Database is not available, attempt {attempt + 1} of {retries + 1}: {e}')
+            await asyncio.sleep(1)
+    stats = pool_stats(engine.pool)
+    logger.info(f'Database is available, pool: {stats}')
+    return stats
 
 
 async def get_async_session() -> Generator:
-    async with AsyncSession(async_engine) as session:
+    async with AsyncSession(get_engine()) as session:
         yield session
 
 
@@ -0,0 +1,203 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+import hashlib
+import re
+import time
+import uuid
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from utils.config import settings
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+_valid_request_id = re.compile(r'[A-Za-z0-9._-]{1,64}')
+_invalid_span_chars = re.compile(r'[^A-Za-z0-9._-]')
+
+
+class Trace:
+    """Timings of one request, keyed by the id that follows it across services."""
+
+    __slots__ = ('request_id', 'start', 'start_ns', 'spans', 'upstream')
+
+    def __init__(self, request_id: str) -> None:
+        self.request_id = request_id
+        self.start = time.perf_counter()
+        self.start_ns = time.time_ns()
+        self.spans: list[tuple[str, float, float]] = []
+        self.upstream: list[tuple[str, float]] = []
+
+    @property
+    def trace_id(self) -> int:
+        """128-bit trace id for OTLP: the request id itself if it is one, a hash of it otherwise."""
+        if len(self.request_id) == 32:
+            try:
+                return int(self.request_id, 16)
+            except ValueError:
+                pass
+        return int(hashlib.md5(self.request_id.encode()).hexdigest(), 16)
+
+    def to_ns(self, timestamp: float) -> int:
+        return self.start_ns + int((timestamp - self.start) * 1e9)
+
+    def server_timing(self) -> str:
+        totals: dict[str, float] = {}
+        for name, start, end in self.spans:
+            totals[name] = totals.get(name, 0.0) + end - start
+        for name, duration in self.upstream:
+            totals[name] = totals.get(name, 0.0) + duration
+        totals['total'] = time.perf_counter() - self.start
+        return ', '.join(f'{name};dur={duration * 1000:.1f}' for name, duration in totals.items())
+
+
+_current_trace: ContextVar[Trace | None] = ContextVar('trace', default=None)
+
+
+def span_name(name: str) -> str:
+    """Make a name safe to use as a Server-Timing metric name."""
+    return _invalid_span_chars.sub('_', name)
+
+
+def record_span(name: str, start: float, end: float) -> None:
+    """Add a finished span, timed with `time.perf_counter`, to the current request."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.spans.append((name, start, end))
+
+
+@contextmanager
+def span(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, start, time.perf_counter())
+
+
+def trace_headers() -> dict:
+    """Headers that carry the current request id to another service."""
+    trace = _current_trace.get()
+    return {REQUEST_ID_HEADER: trace.request_id} if trace is not None else {}
+
+
+def merge_server_timing(header: str | None, prefix: str) -> None:
+    """Fold the Server-Timing of an upstream response into the current request's breakdown."""
+    trace = _current_trace.get()
+    if trace is None or not header:
+        return
+    for metric in header.split(','):
+        name, *params = (part.strip() for part in metric.split(';'))
+        for param in params:
+            key, _, value = param.partition('=')
+            if key == 'dur':
+                try:
+                    trace.upstream.append((f'{prefix}{name}', float(value) / 1000))
+                except ValueError:
+                    pass
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Record the time of every statement the engine runs as a `db` span.
+
+    The start is kept on the statement's execution context rather than the connection,
+    so a statement that fails, and never reaches `after_cursor_execute`, leaves nothing behind.
+    """
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        context.query_start = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def end_query(conn, cursor, statement, parameters, context, executemany):
+        record_span('db', context.query_start, time.perf_counter())
+
+
+class OTLPExporter:
+    """Export finished traces to an OTLP/HTTP collector. Needs the optional `opentelemetry` packages.
+
+    Spans of one request share a trace id derived from its request id, so the spans
+    of both services end up in the same trace.
+    """
+
+    def __init__(self, endpoint: str, service_name: str) -> None:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.sdk.trace.id_generator import RandomIdGenerator
+        from opentelemetry.trace import set_span_in_context
+
+        class RequestIdGenerator(RandomIdGenerator):
+            def generate_trace_id(self) -> int:
+                trace = _current_trace.get()
+                return trace.trace_id if trace is not None else super().generate_trace_id()
+
+        self._provider = TracerProvider(
+            resource=Resource.create({'service.name': service_name}),
+            id_generator=RequestIdGenerator(),
+        )
+        self._provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=endpoint)))
+        self._tracer = self._provider.get_tracer(__name__)
+        self._set_span_in_context = set_span_in_context
+
+    def export(self, trace: Trace, name: str, end: float) -> None:
+        root = self._tracer.start_span(
+            name,
+            start_time=trace.start_ns,
+            attributes={'request.id': trace.request_id},
+        )
+        context = self._set_span_in_context(root)
+        for child_name, start, span_end in trace.spans:
+            child = self._tracer.start_span(child_name, context=context, start_time=trace.to_ns(start))
+            child.end(end_time=trace.to_ns(span_end))
+        root.end(end_time=trace.to_ns(end))
+
+    def shutdown(self) -> None:
+        self._provider.shutdown()
+
+
+def build_exporter() -> OTLPExporter | None:
+    if settings.OTLP_ENDPOINT:
+        return OTLPExporter(settings.OTLP_ENDPOINT, settings.OTLP_SERVICE_NAME)
+    return None
+
+
+exporter = build_exporter()
+
+
+class TracingMiddleware:
+    """Give every request an id and answer with a Server-Timing breakdown of its spans.
+
+    An incoming X-Request-ID is reused, so one id follows a request across services.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        request_id = dict(scope['headers']).get(REQUEST_ID_HEADER.lower().encode(), b'').decode('latin-1')
+        if not _valid_request_id.fullmatch(request_id):
+            request_id = uuid.uuid4().hex
+        trace = Trace(request_id)
+        token = _current_trace.set(trace)
+
+        async def send_with_timing(message: Message) -> None:
+            if message['type'] == 'http.response.start':
+                headers = MutableHeaders(scope=message)
+                headers.append(REQUEST_ID_HEADER, request_id)
+                headers.append('Server-Timing', trace.server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            if exporter is not None:
+                route = scope.get('route')
+                name = f'{scope["method"]} {route.path if route is not None else "unmatched"}'
+                exporter.export(trace, name, time.perf_counter())
+            _current_trace.reset(token)
@@ -0,0 +1,101 @@
+import asyncio
+import contextlib
+import logging
+import logging.config
+
+from sqlalchemy import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from gateway.api_gateway import APIGateway
+from schemas.outbox import DeletionOutbox
+from utils.config import settings
+from utils.errors import GatewayError
+from utils.sessions import async_session
+
+logging.config.dictConfig(settings.LOGGING_CONFIG)
+
+logger = logging.getLogger(__name__)
+
+
+class DeletionOutboxWorker:
+    """Background task that drains the deletion outbox into batched storage deletes.
+
+    Rows are claimed with `FOR UPDATE SKIP LOCKED`, so several app workers can
+    drain the same outbox without deleting a name twice. A row that failed
+    `max_attempts` times is parked: it stays in the table for inspection but is
+    no longer claimed.
+    """
+
+    def __init__(
+            self,
+            batch_size: int = settings.OUTBOX_BATCH_SIZE,
+            poll_interval: float = settings.OUTBOX_POLL_INTERVAL,
+            max_attempts: int = settings.OUTBOX_MAX_ATTEMPTS,
+    ) -> None:
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self._task: asyncio.Task | None = None
+        self._wakeup: asyncio.Event | None = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    def wake(self) -> None:
+        """Drain now instead of at the next poll."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def drain(self, session: AsyncSession) -> int:
+        """Delete one batch of queued objects and return how many were deleted."""
+        query = (
+            select(DeletionOutbox)
+            .where(DeletionOutbox.attempts < self.max_attempts)
+            .order_by(DeletionOutbox.attempts, DeletionOutbox.id)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        entries = (await session.scalars(query)).all()
+        if not entries:
+            return 0
+        try:
+            result = await APIGateway.delete_files(sorted({entry.name for entry in entries}))
+        except GatewayError as e:
+            # Counted as a failed attempt of every entry, so a batch that always fails gets parked
+            logger.error(f'Deletion outbox: {e}')
+            result = {'deleted': [], 'errors': [{'name': entry.name, 'message': str(e)} for entry in entries]}
+        deleted = set(result['deleted'])
+        for entry in entries:
+            if entry.name in deleted:
+                await session.delete(entry)
+                continue
+            entry.attempts += 1
+            if entry.attempts >= self.max_attempts:
+                logger.error(f'Deletion outbox: parked {entry.name} after {entry.attempts} failed attempts')
+        await session.commit()
+        logger.info(f'Deletion outbox drained: {len(deleted)}, failed: {len(result["errors"])}')
+        return sum(entry.name in deleted for entry in entries)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                async with async_session() as session:
+                    while await self.drain(session) >= self.batch_size:
+                        pass
+            except Exception as e:
+                logger.error(f'Deletion outbox: {e}')
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            self._wakeup.clear()
+
+
+deletion_worker = DeletionOutboxWorker()
@@ -0,0 +1,240 @@
+"""Reconcile the memes table with the MinIO bucket.
+
+Both sides are streamed in name order and merged, so memory use does not grow
+with the number of memes. Only memes changed after the stored watermark are
+compared, unless --full is given. Orphans are reported, and with --repair an
+object without a row is queued for deletion and a row without an object is
+deleted. Direct uploads reserved more than UPLOAD_RESERVATION_TTL seconds ago
+and never committed are dropped on every run.
+
+    python -m workers.reconciliation [--repair] [--full]
+"""
+import argparse
+import asyncio
+import contextlib
+from collections.abc import AsyncIterator
+from datetime import datetime, timedelta
+import json
+import logging
+import logging.config
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from gateway.api_gateway import APIGateway
+from repositories.memes import MemeRepository
+from schemas.memes import Meme
+from schemas.outbox import DeletionOutbox
+from schemas.reconciliation import ReconciliationWatermark
+from utils.config import settings
+from utils.errors import EntityDoesNotExist
+from utils.sessions import get_engine
+from workers.outbox import deletion_worker
+
+logging.config.dictConfig(settings.LOGGING_CONFIG)
+
+logger = logging.getLogger(__name__)
+
+# Key of the advisory lock that keeps app workers from reconciling at the same time
+RECONCILIATION_LOCK_ID = 7_305_289
+
+
+class Reconciler:
+    """One reconciliation pass; `bind` defaults to the application's engine."""
+
+    watermark_name = 'memes'
+
+    def __init__(
+            self,
+            repair: bool = False,
+            full: bool = False,
+            bind: AsyncEngine | AsyncConnection | None = None,
+    ) -> None:
+        self.repair = repair
+        self.full = full
+        self.bind = bind
+        self.report = {'checked': 0, 'orphan_objects': 0, 'orphan_rows': 0, 'repaired': 0, 'expired_reservations': 0}
+        self._seen: datetime | None = None
+        self._unresolved: datetime | None = None
+
+    async def _iter_rows(self, session: AsyncSession, since: datetime | None) -> AsyncIterator:
+        # COLLATE "C" orders names bytewise, the same way the bucket lists keys
+        query = (
+            select(Meme.id, Meme.name, Meme.last_updated_at, Meme.is_committed)
+            .order_by(Meme.name.collate('C'))
+            .execution_options(yield_per=settings.RECONCILE_BATCH_SIZE)
+        )
+        if since is not None:
+            query = query.where(Meme.last_updated_at > since)
+        result = await session.stream(query)
+        async for row in result:
+            yield row
+
+    @staticmethod
+    async def _iter_objects(since: datetime | None) -> AsyncIterator[dict]:
+        # The bucket cannot be filtered by date, so the listing is read in full but only
+        # changed objects take part in the merge
+        async for obj in APIGateway.iter_files(settings.RECONCILE_BATCH_SIZE):
+            obj['last_updated_at'] = datetime.fromisoformat(obj['last_updated_at'])
+            if since is None or obj['last_updated_at'] > since:
+                yield obj
+
+    @staticmethod
+    async def _merge(rows: AsyncIterator, objects: AsyncIterator[dict]) -> AsyncIterator[tuple]:
+        """Pair rows and objects with the same name; either side is None if missing."""
+        row, obj = await anext(rows, None), await anext(objects, None)
+        while row is not None or obj is not None:
+            if obj is None or (row is not None and row.name < obj['name']):
+                yield row, None
+                row = await anext(rows, None)
+            elif row is None or obj['name'] < row.name:
+                yield None, obj
+                obj = await anext(objects, None)
+            else:
+                yield row, obj
+                row, obj = await anext(rows, None), await anext(objects, None)
+
+    def _mark(self, timestamp: datetime, resolved: bool = True) -> None:
+        self._seen = max(self._seen or timestamp, timestamp)
+        if not resolved:
+            self._unresolved = min(self._unresolved or timestamp, timestamp)
+
+    async def _check_object(self, session: AsyncSession, obj: dict) -> bool:
+        """Handle an object no changed row matched; return whether it is settled."""
+        exists = await session.scalar(select(Meme.id).where(Meme.name == obj['name']))
+        pending = await session.scalar(select(DeletionOutbox.id).where(DeletionOutbox.name == obj['name']).limit(1))
+        if exists is not None or pending is not None:
+            return True
+        self.report['orphan_objects'] += 1
+        logger.warning(f'Object without a meme: {obj["name"]}')
+        if not self.repair:
+            return False
+        session.add(DeletionOutbox(name=obj['name']))
+        await session.commit()
+        deletion_worker.wake()
+        self.report['repaired'] += 1
+        return True
+
+    async def _check_row(self, session: AsyncSession, row) -> bool:
+        """Handle a row no changed object matched; return whether it is settled."""
+        if not row.is_committed or await APIGateway.stat_file(row.name) is not None:
+            return True
+        self.report['orphan_rows'] += 1
+        logger.warning(f'Meme without an object: {row.name}')
+        if not self.repair:
+            return False
+        with contextlib.suppress(EntityDoesNotExist):
+            await MemeRepository(session).delete(row.id)
+        self.report['repaired'] += 1
+        return True
+
+    async def run(self) -> dict:
+        async with (
+            AsyncSession(self.bind or get_engine()) as stream_session,
+            AsyncSession(self.bind or get_engine(), expire_on_commit=False) as session,
+        ):
+            if not await stream_session.scalar(select(func.pg_try_advisory_xact_lock(RECONCILIATION_LOCK_ID))):
+                logger.info('Reconciliation skipped: another run is in progress')
+                return {**self.report, 'skipped': True}
+
+            watermark = await session.get(ReconciliationWatermark, self.watermark_name)
+            since = None
+            if watermark is not None and not self.full:
+                since = watermark.value - timedelta(seconds=settings.RECONCILE_GRACE_SECONDS)
+            # Objects and rows this fresh may belong to a create still in flight
+            cutoff = datetime.utcnow() - timedelta(seconds=settings.RECONCILE_GRACE_SECONDS)
+
+            async for row, obj in self._merge(self._iter_rows(stream_session, since), self._iter_objects(since)):
+                self.report['checked'] += 1
+                timestamp = max(
+                    row.last_updated_at if row is not None else datetime.min,
+                    obj['last_updated_at'] if obj is not None else datetime.min,
+                )
+                if timestamp > cutoff:
+                    self._mark(timestamp, resolved=False)
+                elif obj is None:
+                    self._mark(timestamp, await self._check_row(session, row))
+                elif row is None:
+                    self._mark(timestamp, await self._check_object(session, obj))
+                else:
+                    self._mark(timestamp)
+
+            # Later runs start after everything settled, but never past an unsettled meme
+            if self._seen is not None:
+                value = self._seen
+                if self._unresolved is not None:
+                    value = min(value, self._unresolved - timedelta(microseconds=1))
+                if watermark is None:
+                    watermark = ReconciliationWatermark(name=self.watermark_name, value=value)
+                watermark.value = value
+                session.add(watermark)
+                await session.commit()
+
+            self.report['expired_reservations'] = await MemeRepository(session).expire_reservations(
+                datetime.utcnow() - timedelta(seconds=settings.UPLOAD_RESERVATION_TTL)
+            )
+
+        logger.info(f'Reconciliation finished: {self.report}')
+        return self.report
+
+
+class ReconciliationWorker:
+    """Background task that reconciles every `interval` seconds; 0 disables it.
+
+    Every `full_every`-th run ignores the watermark, so a row whose object vanished
+    without the row changing is found too.
+    """
+
+    def __init__(
+            self,
+            interval: float = settings.RECONCILE_INTERVAL,
+            repair: bool = settings.RECONCILE_REPAIR,
+            full_every: int = settings.RECONCILE_FULL_EVERY,
+    ) -> None:
+        self.interval = interval
+        self.repair = repair
+        self.full_every = full_every
+        self._runs = 0
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            self._runs += 1
+            full = self.full_every > 0 and self._runs % self.full_every == 0
+            try:
+                await Reconciler(repair=self.repair, full=full).run()
+            except Exception as e:
+                logger.error(f'Reconciliation: {e}')
+
+
+reconciliation_worker = ReconciliationWorker()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repair', action='store_true', help='fix the orphans that are found')
+    parser.add_argument('--full', action='store_true', help='ignore the watermark and check every meme')
+    args = parser.parse_args()
+
+    await APIGateway.startup()
+    try:
+        print(json.dumps(await Reconciler(repair=args.repair, full=args.full).run()))
+    finally:
+        await APIGateway.shutdown()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
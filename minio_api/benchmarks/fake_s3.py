@@ -0,0 +1,240 @@
+"""In-memory stand-in for MinIO that speaks enough of the S3 API for MinioRepository.
+
+Supports bucket HEAD/PUT, object PUT (plain and server-side copy), HEAD, GET with
+a byte range, DELETE, multi-object delete and ListObjectsV2, including MinIO's
+user metadata in listings. Multipart uploads and request signatures are not
+checked or supported; objects live in memory until the process exits.
+"""
+import asyncio
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from email.utils import format_datetime
+import hashlib
+import threading
+from urllib.parse import quote_plus, unquote
+from xml.etree import ElementTree as ET
+from xml.sax.saxutils import escape
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+import uvicorn
+
+S3_NAMESPACE = 'http://s3.amazonaws.com/doc/2006-03-01/'
+# Headers stored with an object besides its x-amz-meta-* user metadata
+STORED_HEADERS = ('content-type', 'cache-control', 'content-disposition', 'content-encoding', 'content-language')
+
+
+@dataclass
+class StoredObject:
+    data: bytes
+    headers: dict[str, str]
+    etag: str = field(init=False)
+    last_modified: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+
+    def __post_init__(self) -> None:
+        self.etag = hashlib.md5(self.data).hexdigest()
+
+    @property
+    def user_metadata(self) -> dict[str, str]:
+        return {k: v for k, v in self.headers.items() if k.startswith('x-amz-meta-')}
+
+    def response_headers(self) -> dict[str, str]:
+        return {
+            **self.headers,
+            'content-type': self.headers.get('content-type', 'application/octet-stream'),
+            'etag': f'"{self.etag}"',
+            'last-modified': format_datetime(self.last_modified.replace(microsecond=0), usegmt=True),
+            'accept-ranges': 'bytes',
+        }
+
+
+def _xml(body: str, status_code: int = 200) -> Response:
+    return Response(
+        f'<?xml version="1.0" encoding="UTF-8"?>\n{body}',
+        status_code=status_code,
+        media_type='application/xml',
+    )
+
+
+def _error(code: str, message: str, resource: str, status_code: int) -> Response:
+    return _xml(
+        f'<Error><Code>{code}</Code><Message>{escape(message)}</Message>'
+        f'<Resource>{escape(resource)}</Resource><RequestId></RequestId><HostId></HostId></Error>',
+        status_code,
+    )
+
+
+def _request_headers(request: Request) -> dict[str, str]:
+    return {
+        k: v for k, v in request.headers.items()
+        if k.startswith('x-amz-meta-') or k in STORED_HEADERS
+    }
+
+
+def _iso8601(value: datetime) -> str:
+    return value.strftime('%Y-%m-%dT%H:%M:%S.') + f'{value.microsecond // 1000:03d}Z'
+
+
+class FakeS3:
+    """ASGI app holding buckets of objects in memory; `latency` seconds are added to every request."""
+
+    def __init__(self, buckets: list[str] | None = None, latency: float = 0.0) -> None:
+        self.buckets: dict[str, dict[str, StoredObject]] = {name: {} for name in buckets or []}
+        self.latency = latency
+        self.app = Starlette(routes=[
+            Route('/{bucket}', self.bucket_endpoint, methods=['GET', 'HEAD', 'PUT', 'POST']),
+            Route('/{bucket}/{key:path}', self.object_endpoint, methods=['GET', 'HEAD', 'PUT', 'DELETE']),
+        ])
+
+    async def __call__(self, scope, receive, send) -> None:
+        if self.latency and scope['type'] == 'http':
+            await asyncio.sleep(self.latency)
+        await self.app(scope, receive, send)
+
+    async def bucket_endpoint(self, request: Request) -> Response:
+        name = request.path_params['bucket']
+        if request.method == 'PUT':
+            self.buckets.setdefault(name, {})
+            return Response()
+        bucket = self.buckets.get(name)
+        if bucket is None:
+            if request.method == 'HEAD':
+                return Response(status_code=404)
+            return _error('NoSuchBucket', 'The specified bucket does not exist', f'/{name}', 404)
+        if request.method == 'HEAD':
+            return Response()
+        if request.method == 'POST' and 'delete' in request.query_params:
+            return self._delete_objects(bucket, await request.body())
+        if request.method == 'GET' and request.query_params.get('list-type') == '2':
+            return self._list_objects(name, bucket, request.query_params)
+        return _error('NotImplemented', 'Not supported by the fake', request.url.path, 501)
+
+    async def object_endpoint(self, request: Request) -> Response:
+        name, key = request.path_params['bucket'], request.path_params['key']
+        resource = f'/{name}/{key}'
+        bucket = self.buckets.get(name)
+        if bucket is None:
+            return _error('NoSuchBucket', 'The specified bucket does not exist', resource, 404)
+        if request.method == 'PUT':
+            if 'uploadId' in request.query_params or 'uploads' in request.query_params:
+                return _error('NotImplemented', 'Multipart uploads are not supported', resource, 501)
+            if 'x-amz-copy-source' in request.headers:
+                return self._copy_object(bucket, key, request)
+            obj = StoredObject(await request.body(), _request_headers(request))
+            bucket[key] = obj
+            return Response(headers={'etag': f'"{obj.etag}"'})
+        if request.method == 'DELETE':
+            bucket.pop(key, None)
+            return Response(status_code=204)
+
+        obj = bucket.get(key)
+        if obj is None:
+            if request.method == 'HEAD':
+                return Response(status_code=404)
+            return _error('NoSuchKey', 'The specified key does not exist.', resource, 404)
+        headers = obj.response_headers()
+        if request.method == 'HEAD':
+            return Response(headers={**headers, 'content-length': str(len(obj.data))})
+        range_header = request.headers.get('range')
+        if range_header is None:
+            return Response(obj.data, headers=headers)
+        start, _, end = range_header.removeprefix('bytes=').partition('-')
+        start = int(start)
+        end = min(int(end), len(obj.data) - 1) if end else len(obj.data) - 1
+        if start >= len(obj.data):
+            return _error('InvalidRange', 'The requested range is not satisfiable', resource, 416)
+        headers['content-range'] = f'bytes {start}-{end}/{len(obj.data)}'
+        return Response(obj.data[start:end + 1], status_code=206, headers=headers)
+
+    def _copy_object(self, bucket: dict[str, StoredObject], key: str, request: Request) -> Response:
+        source_name, _, source_key = unquote(request.headers['x-amz-copy-source']).lstrip('/').partition('/')
+        source = self.buckets.get(source_name, {}).get(source_key.split('?')[0])
+        if source is None:
+            return _error('NoSuchKey', 'The specified key does not exist.', f'/{source_name}/{source_key}', 404)
+        if request.headers.get('x-amz-metadata-directive', 'COPY').upper() == 'REPLACE':
+            headers = _request_headers(request)
+        else:
+            headers = dict(source.headers)
+        obj = StoredObject(source.data, headers)
+        bucket[key] = obj
+        return _xml(
+            f'<CopyObjectResult xmlns="{S3_NAMESPACE}"><LastModified>{_iso8601(obj.last_modified)}</LastModified>'
+            f'<ETag>"{obj.etag}"</ETag></CopyObjectResult>'
+        )
+
+    @staticmethod
+    def _delete_objects(bucket: dict[str, StoredObject], body: bytes) -> Response:
+        root = ET.fromstring(body)
+        namespace = {'s3': root.tag[1:].split('}')[0]} if root.tag.startswith('{') else {}
+        prefix = 's3:' if namespace else ''
+        quiet = (root.findtext(f'{prefix}Quiet', 'false', namespace) or 'false').lower() == 'true'
+        deleted = []
+        for element in root.findall(f'{prefix}Object', namespace):
+            key = element.findtext(f'{prefix}Key', '', namespace)
+            bucket.pop(key, None)
+            deleted.append(f'<Deleted><Key>{escape(key)}</Key></Deleted>')
+        return _xml(f'<DeleteResult xmlns="{S3_NAMESPACE}">{"" if quiet else "".join(deleted)}</DeleteResult>')
+
+    @staticmethod
+    def _list_objects(name: str, bucket: dict[str, StoredObject], params) -> Response:
+        prefix = params.get('prefix', '')
+        delimiter = params.get('delimiter', '')
+        after = params.get('continuation-token') or params.get('start-after') or ''
+        max_keys = int(params.get('max-keys', 1000))
+        url_encoded = params.get('encoding-type') == 'url'
+        with_metadata = params.get('metadata') == 'true'
+
+        def encode(value: str) -> str:
+            return escape(quote_plus(value) if url_encoded else value)
+
+        # Keys below a delimiter collapse into one common prefix, as in a directory listing
+        entries = {}
+        for key in bucket:
+            if not key.startswith(prefix):
+                continue
+            head, sep, _ = key[len(prefix):].partition(delimiter) if delimiter else (key, '', '')
+            entry = f'{prefix}{head}{sep}' if sep else key
+            if entry > after:
+                entries[entry] = bool(sep)
+        names = sorted(entries)
+        page, truncated = names[:max_keys], len(names) > max_keys
+
+        contents, common_prefixes = [], []
+        for entry in page:
+            if entries[entry]:
+                common_prefixes.append(f'<CommonPrefixes><Prefix>{encode(entry)}</Prefix></CommonPrefixes>')
+                continue
+            obj = bucket[entry]
+            metadata = ''
+            if with_metadata:
+                metadata = '<UserMetadata>' + ''.join(
+                    f'<{k.title()}>{escape(v)}</{k.title()}>'
+                    for k, v in {**obj.user_metadata, 'content-type': obj.response_headers()['content-type']}.items()
+                ) + '</UserMetadata>'
+            contents.append(
+                f'<Contents><Key>{encode(entry)}</Key>'
+                f'<LastModified>{_iso8601(obj.last_modified)}</LastModified><ETag>"{obj.etag}"</ETag>'
+                f'<Size>{len(obj.data)}</Size><StorageClass>STANDARD</StorageClass>{metadata}</Contents>'
+            )
+        next_token = f'<NextContinuationToken>{escape(page[-1])}</NextContinuationToken>' if truncated else ''
+        return _xml(
+            f'<ListBucketResult xmlns="{S3_NAMESPACE}"><Name>{escape(name)}</Name><Prefix>{encode(prefix)}</Prefix>'
+            f'<Delimiter>{encode(delimiter)}</Delimiter><KeyCount>{len(page)}</KeyCount><MaxKeys>{max_keys}</MaxKeys>'
+            f'{"<EncodingType>url</EncodingType>" if url_encoded else ""}'
+            f'<IsTruncated>{"true" if truncated else "false"}</IsTruncated>{next_token}'
+            f'{"".join(contents)}{"".join(common_prefixes)}</ListBucketResult>'
+        )
+
+
+def serve_in_thread(app: FakeS3, host: str, port: int) -> uvicorn.Server:
+    """Serve the fake from a daemon thread of the current process and wait until it listens."""
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level='warning', access_log=False))
+    thread = threading.Thread(target=server.run, name='fake-s3', daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError(f'Fake S3 failed to start on {host}:{port}')
+        threading.Event().wait(0.01)
+    return server
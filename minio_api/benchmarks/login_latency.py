@@ -0,0 +1,120 @@
+"""Latency of /api/auth/token and of other routes while logins are in flight.
+
+Runs the app in-process against the test database and prints one JSON
+document per mode. The `inline` mode verifies passwords on the event loop,
+as the service did before hashing moved to its own pool; `executor` is the
+current behaviour.
+
+    poetry run python -m benchmarks.login_latency --logins 200 --concurrency 20
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from httpx import AsyncClient, ASGITransport
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+import repositories.users
+from schemas.users import User
+from utils.config import settings
+from utils.hashing import hash_password, pwd_context, verify_password
+from utils.sessions import get_db
+
+test_db = (
+    f'postgresql+asyncpg://{settings.POSTGRES_USER}:{settings.POSTGRES_PASSWORD}'
+    f'@{settings.POSTGRES_TEST_SERVER}:{settings.POSTGRES_PORT}/{settings.POSTGRES_TEST_DB}'
+)
+
+
+async def verify_inline(password: str, password_hash: str) -> bool:
+    return pwd_context.verify(password, password_hash)
+
+
+def percentiles(samples: list[float]) -> dict:
+    if len(samples) < 2:
+        return {'p50': None, 'p95': None, 'p99': None}
+    q = statistics.quantiles(samples, n=100)
+    return {'p50': q[49], 'p95': q[94], 'p99': q[98]}
+
+
+async def run(mode: str, logins: int, concurrency: int) -> dict:
+    from main import app
+
+    engine = create_async_engine(test_db)
+    async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    async with engine.begin() as connection:
+        await connection.run_sync(SQLModel.metadata.drop_all)
+        await connection.run_sync(SQLModel.metadata.create_all)
+    async with async_session() as session:
+        session.add(User(
+            username=settings.AUTH_USER,
+            password_hash=await hash_password(settings.AUTH_PASSWORD),
+        ))
+        await session.commit()
+
+    async def override_get_db():
+        async with async_session() as session:
+            yield session
+
+    app.dependency_overrides[get_db] = override_get_db
+    repositories.users.verify_password = verify_inline if mode == 'inline' else verify_password
+
+    login_ms, probe_ms = [], []
+    semaphore = asyncio.Semaphore(concurrency)
+    done = asyncio.Event()
+    form = {'username': settings.AUTH_USER, 'password': settings.AUTH_PASSWORD}
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url='http://bench') as client:
+        async def login():
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post('/api/auth/token', data=form)
+                login_ms.append((time.perf_counter() - start) * 1000)
+                response.raise_for_status()
+
+        async def probe():
+            while not done.is_set():
+                start = time.perf_counter()
+                await client.get('/')
+                probe_ms.append((time.perf_counter() - start) * 1000)
+                await asyncio.sleep(0.005)
+
+        probe_task = asyncio.create_task(probe())
+        start = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(logins)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await probe_task
+
+    await engine.dispose()
+    return {
+        'mode': mode,
+        'bcrypt_rounds': settings.AUTH_BCRYPT_ROUNDS,
+        'hash_workers': settings.AUTH_HASH_WORKERS,
+        'logins': logins,
+        'concurrency': concurrency,
+        'logins_per_second': logins / elapsed,
+        'login_ms': percentiles(login_ms),
+        'other_route_ms': percentiles(probe_ms),
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--logins', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--mode', choices=['inline', 'executor', 'both'], default='both')
+    args = parser.parse_args()
+
+    modes = ['inline', 'executor'] if args.mode == 'both' else [args.mode]
+    for mode in modes:
+        print(json.dumps(await run(mode, args.logins, args.concurrency)))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
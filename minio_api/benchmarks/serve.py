@@ -0,0 +1,57 @@
+"""Run minio_api against the test database and an in-memory S3 fake, for load tests.
+
+The fake is served from a thread of the same process, so no MinIO is needed.
+Tables of the test database are recreated on start and the auth user is added
+by the app's own startup hook.
+
+    poetry run python -m benchmarks.serve --host 0.0.0.0 --port 9100
+"""
+import argparse
+import asyncio
+import logging
+
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import SQLModel
+import uvicorn
+
+from benchmarks.common import free_port
+from benchmarks.fake_s3 import FakeS3, serve_in_thread
+from schemas.users import User
+from utils.config import settings
+
+
+async def reset_database() -> None:
+    engine = create_async_engine(settings.async_database_url)
+    async with engine.begin() as connection:
+        await connection.run_sync(SQLModel.metadata.drop_all, tables=[User.__table__])
+        await connection.run_sync(SQLModel.metadata.create_all, tables=[User.__table__])
+    await engine.dispose()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--s3-latency', type=float, default=0.0, help='seconds added to every storage request')
+    args = parser.parse_args()
+
+    s3_port = free_port()
+    serve_in_thread(FakeS3([settings.MINIO_BUCKET], latency=args.s3_latency), '127.0.0.1', s3_port)
+
+    # Settings are read by the modules below when they are imported
+    settings.MINIO_URL = f'127.0.0.1:{s3_port}'
+    settings.MINIO_PUBLIC_URL = None
+    settings.POSTGRES_SERVER = settings.POSTGRES_TEST_SERVER
+    settings.POSTGRES_DB = settings.POSTGRES_TEST_DB
+    settings.DB_ECHO_LOG = False
+    await reset_database()
+
+    from main import app
+
+    logging.getLogger().setLevel(logging.WARNING)
+    config = uvicorn.Config(app, host=args.host, port=args.port, log_level='warning', access_log=False)
+    await uvicorn.Server(config).serve()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
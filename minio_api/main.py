@@ -4,6 +4,10 @@ from fastapi.middleware.cors import CORSMiddleware
 from routers import minio_router, users
 from utils.config import settings
 from utils.add_sample_data import add_sample_data
+from utils.executors import hash_executor, image_executor, storage_executor
+from utils.metrics import MetricsMiddleware, metrics_response
+from utils.sessions import check_database
+from utils.tracing import TracingMiddleware, exporter
 
 app = FastAPI(
     title=settings.TITLE,
@@ -41,17 +45,44 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=['*'],
     allow_headers=['*'],
+    expose_headers=['X-Request-ID', 'Server-Timing'],
 )
 
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware)
+
+
+@app.on_event('startup')
+async def check_db():
+    await check_database(retries=settings.DB_STARTUP_RETRIES)
+
 
 @app.on_event('startup')
 async def init_data():
     try:
-        add_sample_data()
+        await add_sample_data()
     except Exception:
         pass
 
 
+@app.on_event('shutdown')
+async def close_executors():
+    storage_executor.shutdown()
+    hash_executor.shutdown()
+    image_executor.shutdown()
+
+
+@app.on_event('shutdown')
+async def flush_traces():
+    if exporter is not None:
+        exporter.shutdown()
+
+
 @app.get('/')
 async def root():
     return {'status': 'OK'}
+
+
+@app.get('/metrics', include_in_schema=False)
+async def metrics():
+    return metrics_response()
@@ -1,12 +1,24 @@
+import asyncio
+from collections.abc import AsyncIterator, Callable
+from datetime import timedelta
+import hashlib
+import io
+from itertools import islice
 import logging
 import logging.config
-from typing import BinaryIO
+from typing import Any, BinaryIO
 
 from minio import Minio
+from minio.commonconfig import CopySource, REPLACE
+from minio.deleteobjects import DeleteObject
 from minio.error import S3Error
 
 from utils.config import settings
 from utils.errors import EntityDoesNotExist, UnprocessableEntity
+from utils.executors import BoundedExecutor, image_executor, storage_executor
+from utils.images import DERIVATIVE_CONTENT_TYPE, render_derivative
+from utils.metrics import STORAGE_LATENCY, timed
+from utils.tracing import span, span_name
 
 logging.config.dictConfig(settings.LOGGING_CONFIG)
 
@@ -21,57 +33,315 @@ class MinioRepository:
             secret_key: str,
             bucket: str,
             secure: bool = False,
+            executor: BoundedExecutor = storage_executor,
+            public_endpoint: str | None = None,
+            public_secure: bool = False,
+            region: str | None = None,
+            render_executor: BoundedExecutor = image_executor,
     ) -> None:
-        self.client = Minio(
-            minio_endpoint,
-            access_key=access_key,
-            secret_key=secret_key,
-            secure=secure,
-        )
+        self._client_args = {
+            'access_key': access_key,
+            'secret_key': secret_key,
+            'region': region,
+        }
+        self._endpoint = (minio_endpoint, secure)
+        # Presigned URLs are signed for the host clients will use; with a known
+        # region signing needs no request to the storage
+        self._public_endpoint = (public_endpoint, public_secure) if public_endpoint else self._endpoint
+        self._client: Minio | None = None
+        self._public_client: Minio | None = None
         self.bucket = bucket
+        self._executor = executor
+        self._render_executor = render_executor
+        self._renders: dict[str, asyncio.Future] = {}
+
+    @property
+    def client(self) -> Minio:
+        # Clients and their connection pools are created on first use, not when the app is imported
+        if self._client is None:
+            endpoint, secure = self._endpoint
+            self._client = Minio(endpoint, secure=secure, **self._client_args)
+        return self._client
+
+    @property
+    def public_client(self) -> Minio:
+        if self._public_client is None:
+            endpoint, secure = self._public_endpoint
+            self._public_client = Minio(endpoint, secure=secure, **self._client_args)
+        return self._public_client
+
+    async def _run(self, func: Callable, *args: Any, **kwargs: Any) -> Any:
+        with span(f'minio.{span_name(func.__name__)}'):
+            return await self._executor.run(func, *args, **kwargs)
+
+    @staticmethod
+    def _sha256(file: BinaryIO) -> str:
+        """Hash a seekable file in chunks and rewind it for the upload."""
+        digest = hashlib.sha256()
+        while chunk := file.read(settings.MINIO_HASH_CHUNK_SIZE):
+            digest.update(chunk)
+        file.seek(0)
+        return digest.hexdigest()
+
+    async def _stat_or_none(self, name: str):
+        try:
+            return await self._run(self.client.stat_object, self.bucket, name)
+        except S3Error as e:
+            if e.code in ('NoSuchKey', 'NoSuchObject'):
+                return None
+            raise
 
-    def create_or_update(
+    @timed(STORAGE_LATENCY)
+    async def create_or_update(
             self,
             name: str,
             file: BinaryIO,
             length: int,
             metadata: dict | None = None,
+            sha256: str | None = None,
     ) -> dict:
+        """Store the file unless an object with identical content is already under this name.
+
+        The content is identified by its SHA-256, kept in the object metadata. A matching
+        object is left untouched, or only has its metadata replaced server-side. The file
+        is hashed first unless the caller passes the digest it already computed.
+        """
         try:
-            self.client.put_object(self.bucket, name, file, length=length, metadata=metadata)
-            obj = self.get(name)
+            metadata = {**(metadata or {}), 'sha256': sha256 or await self._run(self._sha256, file)}
+            existing = await self._stat_or_none(name)
+            if existing is not None and self._get_meta(existing.metadata, 'sha256') == metadata['sha256']:
+                if self._get_meta(existing.metadata, 'description') == metadata.get('description'):
+                    logger.info(f'Meme unchanged: {name}')
+                    return {'status': 'Unchanged', **self._to_dict(existing)}
+                return await self.copy(name, name, metadata)
+            await self._run(self.client.put_object, self.bucket, name, file, length=length, metadata=metadata)
+            obj = await self.get(name)
             logger.info(f'Meme created or updated: {name}')
             return {
                 'status': 'Modified',
                 'name': name,
                 'last_updated_at': obj.get('last_updated_at').replace(tzinfo=None),
                 'description': metadata.get('description'),
+                'sha256': metadata['sha256'],
             }
         except Exception as e:
             logger.error(f'Create or update image: {e}')
             raise UnprocessableEntity
 
-    def get(self, name: str) -> dict:
+    @timed(STORAGE_LATENCY)
+    async def copy(self, source: str, name: str, metadata: dict, sha256: str | None = None) -> dict:
+        """Copy an object inside the bucket with new metadata, without transferring its bytes.
+
+        With `sha256` the source must still hold that content, or UnprocessableEntity is raised.
+        """
+        source_obj = await self._run(self.client.stat_object, self.bucket, source)
+        if sha256 is not None and self._get_meta(source_obj.metadata, 'sha256') != sha256:
+            logger.info(f'Copy refused, content of {source} changed')
+            raise UnprocessableEntity
+        metadata = {
+            'Content-Type': source_obj.content_type,
+            'sha256': self._get_meta(source_obj.metadata, 'sha256'),
+            **metadata,
+        }
+        metadata = {k: v for k, v in metadata.items() if v is not None}
+        await self._run(
+            self.client.copy_object,
+            self.bucket,
+            name,
+            CopySource(self.bucket, source),
+            metadata=metadata,
+            metadata_directive=REPLACE,
+        )
+        obj = await self.get(name)
+        logger.info(f'Meme copied: {source} -> {name}')
+        return {'status': 'Modified', **obj}
+
+    @staticmethod
+    def _get_meta(metadata: dict | None, key: str) -> str | None:
+        """Look up user metadata regardless of the key casing the API returned."""
+        key = f'x-amz-meta-{key}'
+        for k, v in (metadata or {}).items():
+            if k.lower() == key:
+                return v
+        return None
+
+    def _to_dict(self, obj) -> dict:
+        return {
+            'name': obj.object_name,
+            'last_updated_at': obj.last_modified.replace(tzinfo=None),
+            'description': self._get_meta(obj.metadata, 'description'),
+            'sha256': self._get_meta(obj.metadata, 'sha256'),
+        }
+
+    def presign(self, name: str, method: str) -> dict:
+        """Sign a URL that lets a client PUT or GET the object directly in storage."""
+        expires = timedelta(seconds=settings.MINIO_PRESIGN_EXPIRE_SECONDS)
+        return {
+            'name': name,
+            'method': method,
+            'url': self.public_client.get_presigned_url(method, self.bucket, name, expires=expires),
+            'expires_in': settings.MINIO_PRESIGN_EXPIRE_SECONDS,
+        }
+
+    @staticmethod
+    def _derived_key(name: str, size: str) -> str:
+        return f'{settings.MINIO_DERIVED_PREFIX}{size}/{name}'
+
+    @staticmethod
+    def is_derived(name: str) -> bool:
+        """Whether the name lies under the prefix renditions are stored under."""
+        return name.startswith(settings.MINIO_DERIVED_PREFIX)
+
+    def _read_object(self, name: str) -> bytes:
+        response = self.client.get_object(self.bucket, name)
         try:
-            obj = self.client.stat_object(self.bucket, name)
-            return {
-                'name': obj.object_name,
-                'last_updated_at': obj.last_modified.replace(tzinfo=None),
-                'description': obj.metadata.get('x-amz-meta-description'),
-            }
+            return response.read()
+        finally:
+            response.close()
+            response.release_conn()
+
+    async def _render(self, name: str, key: str, size: str, source_etag: str):
+        try:
+            data = await self._run(self._read_object, name)
+            with span('render'):
+                content = await self._render_executor.run(
+                    render_derivative,
+                    data,
+                    settings.MINIO_DERIVATIVE_SIZES[size],
+                    settings.MINIO_DERIVATIVE_QUALITY,
+                )
+            await self._run(
+                self.client.put_object,
+                self.bucket,
+                key,
+                io.BytesIO(content),
+                length=len(content),
+                content_type=DERIVATIVE_CONTENT_TYPE,
+                metadata={'source-etag': source_etag},
+            )
+            logger.info(f'Derivative rendered: {key}')
+            return await self._run(self.client.stat_object, self.bucket, key)
+        except Exception as e:
+            logger.error(f'Render {size} of {name}: {e}')
+            raise UnprocessableEntity
+
+    @timed(STORAGE_LATENCY)
+    async def derivative(self, name: str, size: str):
+        """Return the stat of a smaller rendition of an image, rendering it on first use.
+
+        Renditions are stored under the derived prefix and tagged with the ETag of their
+        source, so a replaced original gets fresh ones. Concurrent requests share one render.
+        """
+        source = await self._run(self.client.stat_object, self.bucket, name)
+        key = self._derived_key(name, size)
+        derived = await self._stat_or_none(key)
+        if derived is not None and self._get_meta(derived.metadata, 'source-etag') == source.etag:
+            return derived
+        render = self._renders.get(key)
+        if render is None:
+            render = asyncio.ensure_future(self._render(name, key, size, source.etag))
+            self._renders[key] = render
+            render.add_done_callback(lambda _: self._renders.pop(key, None))
+        return await asyncio.shield(render)
+
+    async def render_derivatives(self, name: str) -> None:
+        """Render every configured size of an image, e.g. right after it was uploaded."""
+        for size in settings.MINIO_DERIVATIVE_SIZES:
+            try:
+                await self.derivative(name, size)
+            except (S3Error, UnprocessableEntity):
+                return
+
+    def _remove_derivatives(self, name: str) -> None:
+        keys = [DeleteObject(self._derived_key(name, size)) for size in settings.MINIO_DERIVATIVE_SIZES]
+        for error in self.client.remove_objects(self.bucket, keys):
+            logger.error(f'Delete derivative {error.name}: {error.message}')
+
+    @timed(STORAGE_LATENCY)
+    async def stat(self, name: str):
+        try:
+            return await self._run(self.client.stat_object, self.bucket, name)
+        except S3Error:
+            logger.error(f'minio.error.S3Error: S3 operation failed, filename={name} does not exist')
+            raise
+
+    async def download(self, name: str, offset: int = 0, length: int = 0) -> AsyncIterator[bytes]:
+        """Yield the object's bytes chunk by chunk; `length=0` reads to the end."""
+        response = await self._run(self.client.get_object, self.bucket, name, offset=offset, length=length)
+        try:
+            chunks = response.stream(settings.MINIO_DOWNLOAD_CHUNK_SIZE)
+            while chunk := await self._run(next, chunks, b''):
+                yield chunk
+        finally:
+            response.close()
+            response.release_conn()
+
+    @timed(STORAGE_LATENCY)
+    async def get(self, name: str) -> dict:
+        try:
+            obj = await self._run(self.client.stat_object, self.bucket, name)
+            return self._to_dict(obj)
         except S3Error:
             logger.error(f'minio.error.S3Error: S3 operation failed, filename={name} does not exist')
             raise
 
-    def list(self) -> list[dict]:
-        objects = list(self.client.list_objects(self.bucket))
-        return [self.get(i.object_name) for i in objects]
+    def _remove_objects(self, names: list[str]) -> list[dict]:
+        keys = [DeleteObject(name) for name in names]
+        keys += [DeleteObject(self._derived_key(name, size)) for name in names for size in settings.MINIO_DERIVATIVE_SIZES]
+        return [
+            {'name': error.name, 'message': error.message}
+            for error in self.client.remove_objects(self.bucket, keys)
+        ]
+
+    @timed(STORAGE_LATENCY)
+    async def delete_many(self, names: list[str]) -> dict:
+        """Delete objects and their renditions with multi-object delete requests.
+
+        Missing objects count as deleted, so a retried batch succeeds.
+        """
+        errors = await self._run(self._remove_objects, names)
+        failed = {error['name'] for error in errors}
+        deleted = [name for name in names if name not in failed]
+        logger.info(f'Images deleted: {len(deleted)}, failed: {len(errors)}')
+        return {'deleted': deleted, 'errors': errors}
+
+    def _list_objects(self, start_after: str | None = None):
+        return self.client.list_objects(
+            self.bucket,
+            start_after=start_after,
+            include_user_meta=True,
+        )
+
+    @timed(STORAGE_LATENCY)
+    async def list(
+            self,
+            start_after: str | None = None,
+            limit: int = settings.MINIO_LIST_PAGE_SIZE,
+    ) -> tuple[list[dict], str | None]:
+        """Return one page of objects after `start_after` and the cursor of the next page.
+
+        Objects and their metadata come from a single listing pass, without a stat per object.
+        """
+        objects = await self._run(lambda: list(islice(self._list_objects(start_after), limit + 1)))
+        page = objects[:limit]
+        next_start_after = page[-1].object_name if len(objects) > limit else None
+        return [self._to_dict(i) for i in page if not i.is_dir and not self.is_derived(i.object_name)], next_start_after
+
+    async def iter_all(self, start_after: str | None = None) -> AsyncIterator[dict]:
+        """Yield every object after `start_after`, fetching the listing batch by batch."""
+        objects = self._list_objects(start_after)
+        while batch := await self._run(lambda: list(islice(objects, settings.MINIO_LIST_PAGE_SIZE))):
+            for obj in batch:
+                if not obj.is_dir and not self.is_derived(obj.object_name):
+                    yield self._to_dict(obj)
 
-    def delete(self, name: str) -> dict:
+    @timed(STORAGE_LATENCY)
+    async def delete(self, name: str) -> dict:
         try:
-            obj = self.get(name)
+            obj = await self.get(name)
             if obj.get('last_updated_at'):
-                self.client.remove_object(self.bucket, name)
+                await self._run(self.client.remove_object, self.bucket, name)
+                await self._run(self._remove_derivatives, name)
                 logger.info(f'Image deleted: {name}')
                 return {
                     'status': 'Deleted',
@@ -1,14 +1,18 @@
 from datetime import datetime, timedelta
+import time
 
 from fastapi.security import OAuth2PasswordRequestForm
 from jose import JWTError, jwt
+from sqlalchemy import event
 from sqlmodel import select
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 from schemas.tokens import TokenData
 from schemas.users import User, UserRead
+from utils.cache import principal_cache
 from utils.config import settings
 from utils.errors import UserCredentialsError
+from utils.hashing import verify_password
 
 
 AUTH_SECRET_KEY = settings.AUTH_SECRET_KEY
@@ -41,6 +45,9 @@ class UserRepository:
         return encoded_jwt
 
     async def get(self, token: str) -> UserRead:
+        """Resolve the user behind a token, from the principal cache when possible."""
+        if user := principal_cache.get(token):
+            return user
         try:
             payload = jwt.decode(token, AUTH_SECRET_KEY, algorithms=[AUTH_ALGORITHM])
             username: str = payload.get('sub')
@@ -52,13 +59,15 @@ class UserRepository:
         user = await self._get_user(token_data.username)
         if user is None:
             raise UserCredentialsError
+        # A cached principal must never outlive its token
+        principal_cache.set(token, user, ttl=payload.get('exp', 0) - time.time())
         return user
 
     async def login(self, form_data: OAuth2PasswordRequestForm) -> dict | None:
         query = select(self.model).where(self.model.username == form_data.username)
         user = await self.session.exec(query)
         user = user.first()
-        if user and user.verify_password(form_data.password):
+        if user and await verify_password(form_data.password, user.password_hash):
             access_token_expires = timedelta(minutes=AUTH_TOKEN_EXPIRE_MINUTES)
             access_token = self._create_access_token(
                 data={'sub': user.username},
@@ -67,3 +76,13 @@ class UserRepository:
             return {'access_token': access_token, 'token_type': 'bearer'}
         else:
             raise UserCredentialsError
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def invalidate_principal(mapper, connection, target: User) -> None:
+    """Drop cached principals of a user whose row changed.
+
+    They are matched by id, since a renamed user's principals carry the old name.
+    """
+    principal_cache.delete_where(lambda user: user.id == target.id)
@@ -1,14 +1,17 @@
 from typing import Annotated
+from urllib.parse import quote
 
-from fastapi import APIRouter, Depends, File, Form, HTTPException, status, Query, UploadFile
+from fastapi import APIRouter, BackgroundTasks, Body, Depends, File, Form, Header, HTTPException, status, Query, Response, UploadFile
+from fastapi.responses import StreamingResponse
 from minio.error import S3Error
 
 from repositories.minio_repo import MinioRepository
 from routers.users import get_current_user
-from schemas.files import FileRead
+from schemas.files import DeleteManyResult, FileRead, PresignedUrl
 from schemas.users import User
 from utils.config import settings
-from utils.errors import EntityDoesNotExist, UnprocessableEntity
+from utils.errors import EntityDoesNotExist, RangeNotSatisfiable, UnprocessableEntity
+from utils.ranges import parse_range
 
 router = APIRouter(prefix='/minio')
 
@@ -18,23 +21,88 @@ minio_repo = MinioRepository(
     settings.MINIO_SECRET_KEY,
     settings.MINIO_BUCKET,
     False,
+    public_endpoint=settings.MINIO_PUBLIC_URL,
+    public_secure=settings.MINIO_PUBLIC_SECURE,
+    region=settings.MINIO_REGION,
 )
 
 
+def check_name(name: str) -> None:
+    """Refuse to write under the renditions prefix, which listings hide and renders overwrite."""
+    if MinioRepository.is_derived(name):
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f'Names starting with {settings.MINIO_DERIVED_PREFIX} are reserved'
+        )
+
+
 @router.post('/create_or_update', response_model=FileRead)
 async def create_or_update(
         file: Annotated[UploadFile, File()],
+        background_tasks: BackgroundTasks,
         description: str = Form(),
+        sha256: str | None = Form(default=None, pattern='^[0-9a-f]{64}$'),
         user: User = Depends(get_current_user),
 ) -> dict:
+    check_name(file.filename)
     try:
         metadata = {'description': description}
-        return minio_repo.create_or_update(file.filename, file.file, file.size, metadata=metadata)
+        result = await minio_repo.create_or_update(file.filename, file.file, file.size, metadata=metadata, sha256=sha256)
     except UnprocessableEntity:
         raise HTTPException(
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
             detail=f'Data is in wrong format'
         )
+    if settings.MINIO_DERIVATIVE_EAGER and result['status'] == 'Modified':
+        background_tasks.add_task(minio_repo.render_derivatives, file.filename)
+    return result
+
+
+@router.post('/copy', response_model=FileRead)
+async def copy(
+        source: str = Form(),
+        name: str = Form(),
+        description: str = Form(),
+        sha256: str | None = Form(default=None),
+        user: User = Depends(get_current_user),
+) -> dict:
+    check_name(name)
+    try:
+        return await minio_repo.copy(source, name, metadata={'description': description}, sha256=sha256)
+    except S3Error:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f'Image with name={source} not found'
+        )
+    except UnprocessableEntity:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f'Image with name={source} no longer has the expected content'
+        )
+
+
+@router.post('/presign_upload', response_model=PresignedUrl)
+async def presign_upload(
+        name: str = Query(),
+        user: User = Depends(get_current_user),
+) -> dict:
+    check_name(name)
+    return minio_repo.presign(name, 'PUT')
+
+
+@router.get('/presign_download', response_model=PresignedUrl)
+async def presign_download(
+        name: str = Query(),
+        user: User = Depends(get_current_user),
+) -> dict:
+    try:
+        await minio_repo.stat(name)
+    except S3Error:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f'Image with name={name} not found'
+        )
+    return minio_repo.presign(name, 'GET')
 
 
 @router.get('/get', response_model=FileRead)
@@ -43,7 +111,7 @@ async def get(
         user: User = Depends(get_current_user),
 ) -> dict:
     try:
-        return minio_repo.get(name=name)
+        return await minio_repo.get(name=name)
     except S3Error:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -51,9 +119,75 @@ async def get(
         )
 
 
+@router.get('/download', response_class=StreamingResponse)
+async def download(
+        name: str = Query(),
+        size: str | None = Query(default=None),
+        range_header: str | None = Header(default=None, alias='Range'),
+        user: User = Depends(get_current_user),
+) -> StreamingResponse:
+    if size is not None and size not in settings.MINIO_DERIVATIVE_SIZES:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f'Size must be one of: {", ".join(settings.MINIO_DERIVATIVE_SIZES)}'
+        )
+    try:
+        obj = await (minio_repo.derivative(name, size) if size else minio_repo.stat(name))
+    except S3Error:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f'Image with name={name} not found'
+        )
+    except UnprocessableEntity:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f'Could not render {name} in size {size}'
+        )
+    try:
+        byte_range = parse_range(range_header, obj.size)
+    except RangeNotSatisfiable:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail=f'Range {range_header} is outside the image',
+            headers={'Content-Range': f'bytes */{obj.size}'},
+        )
+
+    headers = {'Accept-Ranges': 'bytes', 'ETag': f'"{obj.etag}"'}
+    if byte_range is None:
+        start, end, status_code = 0, obj.size - 1, status.HTTP_200_OK
+    else:
+        start, end = byte_range
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+        headers['Content-Range'] = f'bytes {start}-{end}/{obj.size}'
+    headers['Content-Length'] = str(end - start + 1)
+
+    return StreamingResponse(
+        minio_repo.download(obj.object_name, offset=start, length=end - start + 1) if obj.size else iter(()),
+        status_code=status_code,
+        headers=headers,
+        media_type=obj.content_type,
+    )
+
+
 @router.get('/list', response_model=list[FileRead])
-async def list_files(user: User = Depends(get_current_user)) -> list[dict]:
-    return minio_repo.list()
+async def list_files(
+        response: Response,
+        start_after: str | None = Query(default=None),
+        limit: int = Query(default=settings.MINIO_LIST_PAGE_SIZE, gt=0, le=settings.MINIO_LIST_PAGE_SIZE),
+        stream: bool = Query(default=False),
+        user: User = Depends(get_current_user),
+) -> list[dict] | StreamingResponse:
+    if stream:
+        async def ndjson():
+            async for obj in minio_repo.iter_all(start_after=start_after):
+                yield FileRead(**obj).model_dump_json() + '\n'
+
+        return StreamingResponse(ndjson(), media_type='application/x-ndjson')
+
+    objects, next_start_after = await minio_repo.list(start_after=start_after, limit=limit)
+    if next_start_after is not None:
+        response.headers['X-Next-Start-After'] = quote(next_start_after)
+    return objects
 
 
 @router.delete('/delete', response_model=FileRead)
@@ -62,9 +196,17 @@ async def delete(
         user: User = Depends(get_current_user),
 ) -> dict:
     try:
-        return minio_repo.delete(name=name)
+        return await minio_repo.delete(name=name)
     except S3Error:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f'Image with name={name} not found'
         )
+
+
+@router.delete('/delete_many', response_model=DeleteManyResult)
+async def delete_many(
+        names: Annotated[list[str], Body(max_length=settings.MINIO_DELETE_BATCH_SIZE)],
+        user: User = Depends(get_current_user),
+) -> dict:
+    return await minio_repo.delete_many(names)
@@ -6,7 +6,8 @@ from repositories.users import UserRepository
 from schemas.tokens import Token
 from schemas.users import User, UserRead
 from utils.errors import UserCredentialsError
-from utils.sessions import get_session, get_repository
+from utils.sessions import get_repository
+from utils.tracing import span
 
 URL_PREFIX = '/auth'
 router = APIRouter(prefix=URL_PREFIX)
@@ -18,7 +19,8 @@ async def get_current_user(
         repository: UserRepository = Depends(get_repository(UserRepository)),
 ) -> UserRead:
     try:
-        return await repository.get(token)
+        with span('auth'):
+            return await repository.get(token)
     except UserCredentialsError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
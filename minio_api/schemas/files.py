@@ -8,3 +8,21 @@ class FileRead(SQLModel):
     name: str
     last_updated_at: datetime
     description: str | None = None
+    sha256: str | None = None
+
+
+class PresignedUrl(SQLModel):
+    name: str
+    method: str
+    url: str
+    expires_in: int
+
+
+class DeleteError(SQLModel):
+    name: str
+    message: str
+
+
+class DeleteManyResult(SQLModel):
+    deleted: list[str]
+    errors: list[DeleteError]
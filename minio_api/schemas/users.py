@@ -1,8 +1,7 @@
-from passlib.context import CryptContext
 from sqlalchemy import UniqueConstraint
 from sqlmodel import SQLModel, Field
 
-pwd_context = CryptContext(schemes=['bcrypt'])
+from utils.hashing import pwd_context
 
 
 class UserBase(SQLModel):
@@ -11,6 +11,7 @@ from sqlmodel import SQLModel
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 from utils.config import settings
+from utils.tracing import instrument_engine
 from schemas.users import User
 
 test_db = (
@@ -23,6 +24,7 @@ engine = create_async_engine(
     echo=settings.DB_ECHO_LOG,
     future=True,
 )
+instrument_engine(engine.sync_engine)
 
 async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
@@ -45,6 +47,14 @@ async def db_session() -> AsyncSession:
             await session.rollback()
 
 
+@pytest.fixture(autouse=True)
+def clear_cache() -> Generator:
+    from utils.cache import principal_cache
+
+    principal_cache.clear()
+    yield
+
+
 @pytest.fixture()
 def override_get_db(db_session: AsyncSession) -> Callable:
     async def _override_get_db():
@@ -80,6 +90,7 @@ async def async_client_authenticated(app: FastAPI) -> AsyncGenerator:
 
     async with AsyncClient(transport=ASGITransport(app=app), base_url='http://test') as ac:
         yield ac
+    del app.dependency_overrides[get_current_user]
 
 
 @pytest.fixture()
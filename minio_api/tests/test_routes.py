@@ -1,9 +1,14 @@
+import json
 from pathlib import Path
 
 from fastapi import status
+from prometheus_client import REGISTRY
 import pytest
+from sqlalchemy import exc, text
 
+from tests.conftest import test_db
 from utils.config import settings
+from utils.sessions import check_database, create_db_engine
 
 
 async def upload_img(async_client_authenticated):
@@ -26,6 +31,69 @@ async def test_create_or_update(async_client_authenticated):
     assert response.status_code == 200
 
 
+@pytest.mark.asyncio
+async def test_create_or_update_unchanged(async_client_authenticated):
+    await upload_img(async_client_authenticated)
+    response = await upload_img(async_client_authenticated)
+
+    assert response.status_code == 200
+    assert response.json().get('status') == 'Unchanged'
+
+
+@pytest.mark.asyncio
+async def test_create_or_update_derived_name(async_client_authenticated):
+    name = f'{settings.MINIO_DERIVED_PREFIX}small/cat.png'
+    response = await async_client_authenticated.post(
+        'api/minio/create_or_update',
+        files={'file': (name, Path('tests/img', 'cat.png').open('rb'), 'image/png')},
+        data={'description': 'test'},
+    )
+    response_copy = await async_client_authenticated.post(
+        'api/minio/copy',
+        data={'source': 'cat.png', 'name': name, 'description': 'test'},
+    )
+    response_presign = await async_client_authenticated.post(
+        'api/minio/presign_upload',
+        params={'name': name},
+    )
+
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    assert response_copy.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    assert response_presign.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+@pytest.mark.parametrize('sha256, status_code', [('a' * 64, status.HTTP_200_OK), ('abc', status.HTTP_422_UNPROCESSABLE_ENTITY)])
+@pytest.mark.asyncio
+async def test_create_or_update_with_digest(async_client_authenticated, sha256, status_code):
+    response = await async_client_authenticated.post(
+        'api/minio/create_or_update',
+        files={'file': Path('tests/img', 'cat.png').open('rb')},
+        data={'description': 'test', 'sha256': sha256},
+    )
+
+    assert response.status_code == status_code
+    if status_code == status.HTTP_200_OK:
+        assert response.json()['sha256'] == sha256
+
+
+@pytest.mark.parametrize('expected, status_code', [('sha256', status.HTTP_200_OK), ('0' * 64, status.HTTP_409_CONFLICT)])
+@pytest.mark.asyncio
+async def test_copy_checks_content(async_client_authenticated, expected, status_code):
+    uploaded = (await upload_img(async_client_authenticated)).json()
+
+    response = await async_client_authenticated.post(
+        'api/minio/copy',
+        data={
+            'source': 'cat.png',
+            'name': 'cat-copy.png',
+            'description': 'test',
+            'sha256': uploaded['sha256'] if expected == 'sha256' else expected,
+        },
+    )
+
+    assert response.status_code == status_code
+
+
 @pytest.mark.asyncio
 async def test_get(async_client_authenticated):
     await upload_img(async_client_authenticated)
@@ -38,6 +106,86 @@ async def test_get(async_client_authenticated):
     assert response.json().get('description') == 'test'
 
 
+@pytest.mark.asyncio
+async def test_download(async_client_authenticated):
+    await upload_img(async_client_authenticated)
+
+    response = await async_client_authenticated.get(
+        'api/minio/download?name=cat.png',
+    )
+
+    assert response.status_code == 200
+    assert response.content == Path('tests/img', 'cat.png').read_bytes()
+
+
+@pytest.mark.asyncio
+async def test_download_range(async_client_authenticated):
+    await upload_img(async_client_authenticated)
+
+    response = await async_client_authenticated.get(
+        'api/minio/download?name=cat.png',
+        headers={'Range': 'bytes=0-9'},
+    )
+
+    assert response.status_code == 206
+    assert response.content == Path('tests/img', 'cat.png').read_bytes()[:10]
+
+
+@pytest.mark.parametrize('range_header', ['bytes=5-3', 'bytes=\u00b2-', 'bytes=0-1,4-5', 'items=0-9'])
+@pytest.mark.asyncio
+async def test_download_ignored_range(async_client_authenticated, range_header):
+    await upload_img(async_client_authenticated)
+
+    response = await async_client_authenticated.get(
+        'api/minio/download?name=cat.png',
+        headers={'Range': range_header.encode('latin-1')},
+    )
+
+    assert response.status_code == 200
+    assert response.content == Path('tests/img', 'cat.png').read_bytes()
+
+
+@pytest.mark.asyncio
+async def test_download_derivative(async_client_authenticated):
+    await upload_img(async_client_authenticated)
+
+    response = await async_client_authenticated.get(
+        'api/minio/download?name=cat.png&size=thumb',
+    )
+
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'image/webp'
+
+
+@pytest.mark.asyncio
+async def test_download_unknown_size(async_client_authenticated):
+    response = await async_client_authenticated.get(
+        'api/minio/download?name=cat.png&size=huge',
+    )
+
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_presign_upload(async_client_authenticated):
+    response = await async_client_authenticated.post(
+        'api/minio/presign_upload?name=cat.png',
+    )
+
+    assert response.status_code == 200
+    assert response.json()['method'] == 'PUT'
+    assert 'X-Amz-Signature=' in response.json()['url']
+
+
+@pytest.mark.asyncio
+async def test_presign_download_missing(async_client_authenticated):
+    response = await async_client_authenticated.get(
+        'api/minio/presign_download?name=missing.png',
+    )
+
+    assert response.status_code == 404
+
+
 @pytest.mark.asyncio
 async def test_list(async_client_authenticated):
     await upload_img(async_client_authenticated)
@@ -50,6 +198,31 @@ async def test_list(async_client_authenticated):
     assert len(response.json()) >= 1
 
 
+@pytest.mark.asyncio
+async def test_list_paginated(async_client_authenticated):
+    await upload_img(async_client_authenticated)
+
+    response = await async_client_authenticated.get(
+        'api/minio/list?limit=1',
+    )
+
+    assert response.status_code == 200
+    assert len(response.json()) == 1
+
+
+@pytest.mark.asyncio
+async def test_list_stream(async_client_authenticated):
+    await upload_img(async_client_authenticated)
+
+    response = await async_client_authenticated.get(
+        'api/minio/list?stream=true',
+    )
+
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    assert any(json.loads(line).get('name') == 'cat.png' for line in response.text.splitlines())
+
+
 @pytest.mark.asyncio
 async def test_delete(async_client_authenticated):
     await upload_img(async_client_authenticated)
@@ -66,6 +239,20 @@ async def test_delete(async_client_authenticated):
     assert response_get.status_code == 404
 
 
+@pytest.mark.asyncio
+async def test_delete_many(async_client_authenticated):
+    await upload_img(async_client_authenticated)
+
+    response = await async_client_authenticated.request(
+        'DELETE',
+        'api/minio/delete_many',
+        json=['cat.png', 'missing.png'],
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {'deleted': ['cat.png', 'missing.png'], 'errors': []}
+
+
 @pytest.mark.parametrize(
     'user_info, status_code',
     [
@@ -81,3 +268,76 @@ async def test_login(create_user, async_client, user_info, status_code):
     response = await async_client.post('api/auth/token', data=user_info)
 
     assert response.status_code == status_code
+
+
+@pytest.mark.parametrize('change', ['rename', 'delete'])
+@pytest.mark.asyncio
+async def test_token_rejected_after_user_change(create_user, db_session, async_client, change):
+    user = await create_user()
+    response = await async_client.post(
+        'api/auth/token',
+        data={'username': settings.AUTH_USER, 'password': settings.AUTH_PASSWORD},
+    )
+    headers = {'Authorization': f'Bearer {response.json()["access_token"]}'}
+    response_before = await async_client.get('api/minio/list', headers=headers)
+
+    if change == 'rename':
+        user.username = 'renamed'
+    else:
+        await db_session.delete(user)
+    await db_session.commit()
+    response_after = await async_client.get('api/minio/list', headers=headers)
+
+    assert response_before.status_code == status.HTTP_200_OK
+    assert response_after.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+@pytest.mark.asyncio
+async def test_metrics(async_client):
+    response = await async_client.get('metrics')
+
+    assert response.status_code == 200
+    assert 'executor_pool_size{executor="minio"}' in response.text
+
+
+@pytest.mark.asyncio
+async def test_server_timing(async_client_authenticated):
+    await upload_img(async_client_authenticated)
+
+    response = await async_client_authenticated.get(
+        'api/minio/get?name=cat.png',
+    )
+
+    assert len(response.headers['X-Request-ID']) == 32
+    assert 'minio.stat_object;dur=' in response.headers['Server-Timing']
+
+
+@pytest.mark.asyncio
+async def test_database_pool(monkeypatch):
+    monkeypatch.setattr(settings, 'DB_POOL_SIZE', 1)
+    monkeypatch.setattr(settings, 'DB_MAX_OVERFLOW', 0)
+    monkeypatch.setattr(settings, 'DB_POOL_TIMEOUT', 0.1)
+    engine = create_db_engine(test_db)
+    try:
+        stats = await check_database(engine)
+        assert stats == {'size': 1, 'checked_in': 1, 'checked_out': 0, 'overflow': 0}
+
+        timeouts = REGISTRY.get_sample_value('db_pool_timeouts_total')
+        async with engine.connect():
+            with pytest.raises(exc.TimeoutError):
+                await check_database(engine)
+        assert REGISTRY.get_sample_value('db_pool_timeouts_total') == timeouts + 1
+    finally:
+        await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_database_without_statement_cache(monkeypatch):
+    monkeypatch.setattr(settings, 'DB_STATEMENT_CACHE_SIZE', 0)
+    engine = create_db_engine(test_db)
+    try:
+        async with engine.connect() as connection:
+            for value in (1, 2):
+                assert await connection.scalar(text('SELECT CAST(:value AS integer)'), {'value': value}) == value
+    finally:
+        await engine.dispose()
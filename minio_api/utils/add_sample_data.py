@@ -1,22 +1,23 @@
-from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from schemas.users import User
 from utils.config import settings
-from utils.sessions import engine
+from utils.hashing import hash_password
+from utils.sessions import get_engine
 
 
-def add_to_db(session: Session, item) -> None:
+async def add_to_db(session: AsyncSession, item) -> None:
     session.add(item)
-    session.commit()
-    session.refresh(item)
+    await session.commit()
+    await session.refresh(item)
 
 
-def create_entries(session: Session) -> None:
+async def create_entries(session: AsyncSession) -> None:
     user = User(username=settings.AUTH_USER)
-    user.set_password(settings.AUTH_PASSWORD)
-    add_to_db(session, user)
+    user.password_hash = await hash_password(settings.AUTH_PASSWORD)
+    await add_to_db(session, user)
 
 
-def add_sample_data():
-    with Session(engine) as session:
-        create_entries(session)
+async def add_sample_data():
+    async with AsyncSession(get_engine()) as session:
+        await create_entries(session)
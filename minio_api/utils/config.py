@@ -26,12 +26,33 @@ class Settings(BaseSettings):
     MINIO_BUCKET: str = os.getenv('MINIO_BUCKET')
     MINIO_ROOT_USER: str = os.getenv('MINIO_ROOT_USER')
     MINIO_ROOT_PASSWORD: str = os.getenv('MINIO_ROOT_PASSWORD')
+    MINIO_EXECUTOR_WORKERS: int = 16
+    MINIO_EXECUTOR_QUEUE_SIZE: int = 64
+    MINIO_LIST_PAGE_SIZE: int = 1000
+    MINIO_HASH_CHUNK_SIZE: int = 1024 * 1024
+    MINIO_DOWNLOAD_CHUNK_SIZE: int = 256 * 1024
+    MINIO_PUBLIC_URL: str | None = os.getenv('MINIO_PUBLIC_URL')
+    MINIO_PUBLIC_SECURE: bool = os.getenv('MINIO_PUBLIC_SECURE') == 'True'
+    MINIO_REGION: str = os.getenv('MINIO_REGION', 'us-east-1')
+    MINIO_PRESIGN_EXPIRE_SECONDS: int = 900
+    MINIO_DELETE_BATCH_SIZE: int = 1000
+    MINIO_DERIVED_PREFIX: str = '_derived/'
+    MINIO_DERIVATIVE_SIZES: dict[str, int] = {'thumb': 256, 'web': 1280}
+    MINIO_DERIVATIVE_QUALITY: int = 80
+    MINIO_DERIVATIVE_EAGER: bool = True
+    MINIO_DERIVATIVE_WORKERS: int = 2
+    MINIO_DERIVATIVE_QUEUE_SIZE: int = 8
 
     AUTH_SECRET_KEY: str = os.getenv('AUTH_SECRET_KEY')
     AUTH_ALGORITHM: str = os.getenv('AUTH_ALGORITHM')
     AUTH_TOKEN_EXPIRE_MINUTES: int = os.getenv('AUTH_TOKEN_EXPIRE_MINUTES')
     AUTH_USER: str = os.getenv('AUTH_USER')
     AUTH_PASSWORD: str = os.getenv('AUTH_PASSWORD')
+    AUTH_CACHE_TTL: float = 30.0
+    AUTH_CACHE_MAXSIZE: int = 10000
+    AUTH_BCRYPT_ROUNDS: int = 12
+    AUTH_HASH_WORKERS: int = 4
+    AUTH_HASH_QUEUE_SIZE: int = 256
 
     POSTGRES_USER: str = os.getenv('POSTGRES_USER')
     POSTGRES_PASSWORD: str = os.getenv('POSTGRES_PASSWORD')
@@ -42,6 +63,17 @@ class Settings(BaseSettings):
     POSTGRES_TEST_DB: str = os.getenv('POSTGRES_TEST_DB')
     POSTGRES_TEST_PORT: str = os.getenv('POSTGRES_TEST_PORT')
     DB_ECHO_LOG: bool = True if os.getenv('DEBUG') == 'True' else False
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = os.getenv('DB_POOL_PRE_PING', 'True') == 'True'
+    DB_CONNECT_TIMEOUT: float = 10.0
+    DB_STATEMENT_CACHE_SIZE: int = 100
+    DB_STARTUP_RETRIES: int = 5
+
+    OTLP_ENDPOINT: str | None = os.getenv('OTLP_ENDPOINT')
+    OTLP_SERVICE_NAME: str = 'minio_api'
 
     LOGGING_CONFIG: dict = {
         "version": 1,
@@ -16,3 +16,8 @@ class UnprocessableEntity(Exception):
 class UserCredentialsError(Exception):
     """Raised when username or password are incorrect."""
     pass
+
+
+class RangeNotSatisfiable(Exception):
+    """Raised when a requested byte range lies outside the object."""
+    pass
@@ -0,0 +1,96 @@
+import asyncio
+from collections.abc import Callable
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+import functools
+import multiprocessing
+from typing import Any
+
+from prometheus_client import REGISTRY
+
+from utils.config import settings
+from utils.metrics import ExecutorCollector
+
+
+class BoundedExecutor:
+    """Bounded thread or process pool that runs blocking calls off the event loop.
+
+    At most `max_workers + max_queue` calls are handed to the pool at once;
+    further callers wait on the event loop until a slot frees up. A process
+    pool only accepts picklable module-level functions and arguments.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int, name: str, processes: bool = False) -> None:
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.name = name
+        self.processes = processes
+        self._executor: Executor | None = None
+        self._slots = asyncio.Semaphore(max_workers + max_queue)
+        self._submitted = 0
+        self._waiting = 0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.processes:
+                # Forking a process that runs an event loop and worker threads is unsafe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix=self.name,
+                )
+        return self._executor
+
+    async def run(self, func: Callable, *args: Any, **kwargs: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+        self._submitted += 1
+        try:
+            return await loop.run_in_executor(
+                self._get_executor(),
+                functools.partial(func, *args, **kwargs),
+            )
+        finally:
+            self._submitted -= 1
+            self._slots.release()
+
+    def stats(self) -> dict:
+        return {
+            'pool_size': self.max_workers,
+            'active': min(self._submitted, self.max_workers),
+            'queue_depth': max(self._submitted - self.max_workers, 0) + self._waiting,
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+storage_executor = BoundedExecutor(
+    settings.MINIO_EXECUTOR_WORKERS,
+    settings.MINIO_EXECUTOR_QUEUE_SIZE,
+    name='minio',
+)
+
+hash_executor = BoundedExecutor(
+    settings.AUTH_HASH_WORKERS,
+    settings.AUTH_HASH_QUEUE_SIZE,
+    name='hash',
+)
+
+image_executor = BoundedExecutor(
+    settings.MINIO_DERIVATIVE_WORKERS,
+    settings.MINIO_DERIVATIVE_QUEUE_SIZE,
+    name='image',
+    processes=True,
+)
+
+REGISTRY.register(ExecutorCollector([storage_executor, hash_executor, image_executor]))
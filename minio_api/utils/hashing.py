@@ -0,0 +1,16 @@
+from passlib.context import CryptContext
+
+from utils.config import settings
+from utils.executors import hash_executor
+
+pwd_context = CryptContext(schemes=['bcrypt'], bcrypt__rounds=settings.AUTH_BCRYPT_ROUNDS)
+
+
+async def hash_password(password: str) -> str:
+    """Hash a password in the dedicated hashing pool, keeping bcrypt off the event loop."""
+    return await hash_executor.run(pwd_context.hash, password)
+
+
+async def verify_password(password: str, password_hash: str) -> bool:
+    """Verify a password against its hash in the dedicated hashing pool."""
+    return await hash_executor.run(pwd_context.verify, password, password_hash)
@@ -0,0 +1,20 @@
+import io
+
+from PIL import Image, ImageOps
+
+DERIVATIVE_CONTENT_TYPE = 'image/webp'
+
+
+def render_derivative(data: bytes, max_side: int, quality: int) -> bytes:
+    """Decode an image and re-encode it as WebP no larger than `max_side` on either side.
+
+    Runs in the image process pool, so it must stay a picklable module-level function.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info or 'A' in image.getbands() else 'RGB')
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        out = io.BytesIO()
+        image.save(out, format='WEBP', quality=quality)
+    return out.getvalue()
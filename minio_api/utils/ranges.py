@@ -0,0 +1,31 @@
+import re
+
+from utils.errors import RangeNotSatisfiable
+
+# ASCII digits only: str.isdigit() and \d would also let through e.g. superscripts
+BYTE_RANGE = re.compile(r'bytes=\s*([0-9]*)-([0-9]*)\s*')
+
+
+def parse_range(header: str | None, size: int) -> tuple[int, int] | None:
+    """Parse a single `bytes=` Range header into an inclusive (start, end) pair.
+
+    Returns None when the whole object should be sent: no header, a unit other
+    than bytes, several ranges at once or a malformed range such as `bytes=5-3`,
+    which servers may legitimately ignore.
+    """
+    match = BYTE_RANGE.fullmatch(header) if header else None
+    if match is None:
+        return None
+    start, end = match.groups()
+    if not (start or end) or (start and end and int(start) > int(end)):
+        return None
+    if not start:
+        # Suffix range: the last `end` bytes
+        if int(end) == 0 or size == 0:
+            raise RangeNotSatisfiable
+        return max(size - int(end), 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size:
+        raise RangeNotSatisfiable
+    return start, end